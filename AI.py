@@ -1,261 +1,295 @@
-import copy
+import hashlib
+import json
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, time, timedelta
 
-from google.auth.exceptions import RefreshError
+from google.auth.credentials import AnonymousCredentials
+from google.auth.exceptions import GoogleAuthError, RefreshError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from notion_client import errors
 from pydantic import BaseModel
 from tzlocal import get_localzone
 
+import cassette
 import config
+import durationCache
+import freeTime
+import googleFetch
+import icsFeed
+import journal
+import ledger
+import notionWriteback
+import rateLimiter
+import taskSources
+import whatIf
 
 class Event(BaseModel):
     title: str
     start: str
     end: str
+    # The model's estimate for the whole task, the same on every part of a split task
+    estimated_minutes: int | None = None
 
 class Events(BaseModel):
     events: list[Event]
+
+class Task(BaseModel):
+    id: str
+    title: str
+    priority: str
+    duration: str
+    scheduled_start: datetime | None = None
+    scheduled_end: datetime | None = None
+    event_link: str | None = None
+    source: str = "notion"
+
+# A computed plan that has not been put on the calendar yet
+class Plan(BaseModel):
+    days: int
+    tasks: list[Task] | None
+    events: list[Event] | None
+    fingerprint: str | None
+    created: datetime
     
 # From the tasks, create the events on the AI Tasks Calendar
 def auto_schedule_tasks(days=2):
+    apply_plan(plan_tasks(days))
+
+# Work out the events for the next days without changing the calendar
+# Plans that are kept for later carry a fingerprint of their inputs
+def plan_tasks(days: int, fingerprint: bool = False) -> Plan:
+    googleFetch.reset_stats()
     check_AI_tasks_calendar()
-    parse_passed_tasks()
-    tasks = get_tasks()
-    free_time = find_free_time(days)
+
+    # Taken before reading anything so that changes made while planning invalidate the plan
+    created = cassette.now().astimezone()
+    fingerprint = plan_fingerprint(days) if fingerprint else None
+
+    # The calendars are read while the task sources are still streaming
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        free_time = executor.submit(find_free_time, days)
+        tasks = get_tasks(schedule_window(days))
+        free_time = free_time.result()
+    if config.debug:
+        googleFetch.report_stats()
+
     ai_tasks = find_task_times(days, tasks, free_time)
-    schedule_tasks_on_calendar(ai_tasks)
+    whatIf.remember_tasks(tasks)
+
+    return Plan(days=days, tasks=tasks, events=ai_tasks, fingerprint=fingerprint, created=created)
+
+# Replace the blocks in the plan's days with the planned events
+def apply_plan(plan: Plan):
+    # Tasks or free time that could not be read must not wipe the blocks that are already planned
+    if plan.tasks is None or (plan.tasks and plan.events is None):
+        print("Planning failed, the current blocks are kept")
+        return
+
+    parse_passed_tasks(plan.days)
+    placements = schedule_tasks_on_calendar(plan.events, plan.tasks)
+
+    # Only plans that are applied teach the cache, prepared plans may never be used
+    remember_estimates(plan.events, plan.tasks)
+
+    if config.output_mode == "ics":
+        icsFeed.publish()
+
+    # Only Notion pages can store the planned time, tasks of other sources keep it in the ledger
+    notion_tasks = [task for task in plan.tasks or [] if task.source == "notion"]
+    notion_ids = {task.id for task in notion_tasks}
+
+    # The calendar is updated in the background, Notion gets the links once the events exist
+    journal.flush_async(lambda links: notionWriteback.write_back(
+        notion_tasks,
+        {task_id: (start, end, links.get(event_id)) for task_id, (start, end, event_id) in placements.items() if task_id in notion_ids},
+    ))
+
+# Cheap summary of everything a plan depends on besides the busy time on the calendars
+def plan_fingerprint(days: int) -> str:
+    now = cassette.now()
+    if config.debug_time_starts_at_beginning_of_day:
+        slot = now.date().isoformat()
+    else:
+        slot = now.replace(minute=now.minute // 15 * 15, second=0, microsecond=0).isoformat()
+
+    inputs = [
+        days,
+        slot,
+        [[hours[0].isoformat(), hours[1].isoformat()] for hours in config.work_hours],
+        config.travel_time,
+        config.commute_time,
+        config.use_gemini,
+        config.task_sources,
+        ledger.next_plan_version(),
+        taskSources.versions(taskSources.available()),
+    ]
+    return hashlib.sha1(json.dumps(inputs).encode("utf-8")).hexdigest()
+
+# A plan is current while its fingerprint matches and no calendar event changed since it was made
+def plan_is_current(plan: Plan) -> bool:
+    if plan.fingerprint is None or plan.fingerprint != plan_fingerprint(plan.days):
+        return False
+
+    credentials = {account: google_auth(account) for account in config.google_accounts}
+
+    def changed(account_calendar):
+        account, calendar = account_calendar
+        service = build("calendar", "v3", credentials=credentials[account])
+        return googleFetch.changed_since(service, calendar, plan.created.isoformat())
+
+    return not any(googleFetch.map_concurrently(changed, calendar_list()))
+
+# Planning in the background must never open the Google sign in flow
+def google_authorized() -> bool:
+    return all(os.path.exists(token_path(account)) for account in config.google_accounts)
+
+# The days that a regeneration covers, from the start of today to the end of the last day
+def schedule_window(days: int) -> tuple[datetime, datetime]:
+    start = cassette.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=days)
+
+# The pre-planner checks the calendars on its own thread while the tray may be regenerating,
+# so the check runs once at a time and the calendar list is only ever replaced whole
+calendars_lock = threading.Lock()
 
 # Check if the user has an AI Tasks calendar and if not, create one
+# The calendars of every account are listed concurrently, the AI Tasks calendar lives in the default account
 def check_AI_tasks_calendar():
-    creds = google_auth()
+    # Signing in may wait for the user, which must not hold up the readers of the calendar list
+    credentials = {account: google_auth(account) for account in config.google_accounts}
 
-    service = build("calendar", "v3", credentials=creds)
+    with calendars_lock:
+        def list_calendars(account):
+            service = build("calendar", "v3", credentials=credentials[account])
+            return googleFetch.list_calendars(service, account)
 
-    AI_Tasks = False
+        calendar_lists = googleFetch.map_concurrently(list_calendars, config.google_accounts)
 
-    for calendar in service.calendarList().list().execute()['items']:
-        if calendar["summary"] == "AI Tasks":
-            AI_Tasks = True
-            config.ai_calendar = calendar["id"]
-        else:
-            config.calendars.append(calendar["id"])
-        
+        ai_calendar = None
+        calendars = []
 
-    if AI_Tasks:
-        return
+        for account, account_calendars in zip(config.google_accounts, calendar_lists):
+            for calendar in account_calendars:
+                if calendar["summary"] == "AI Tasks":
+                    if account == config.DEFAULT_ACCOUNT:
+                        ai_calendar = calendar["id"]
+                else:
+                    calendars.append((account, calendar["id"]))
+
+        # The feed needs no calendar, so nothing is created on Google
+        if ai_calendar is None and config.output_mode != "ics":
+            service = build("calendar", "v3", credentials=credentials[config.DEFAULT_ACCOUNT])
 
-    calendar = {
-        "summary": "AI Tasks",
-        "timeZone": get_localzone().key
-    }
+            calendar = {
+                "summary": "AI Tasks",
+                "timeZone": get_localzone().key
+            }
+
+            # A retried insert could create a second AI Tasks calendar
+            ai_calendar = rateLimiter.call("google", service.calendars().insert(body=calendar).execute, idempotent=False)["id"]
+
+        config.calendars = calendars
+        if ai_calendar is not None:
+            config.ai_calendar = ai_calendar
 
-    service.calendars().insert(body=calendar).execute()
+# Readers take the list once, it may be replaced by another thread while they use it
+def calendar_list() -> list[tuple[str, str]]:
+    with calendars_lock:
+        return list(config.calendars)
 
 # Check all the tasks that have finished and ask the user if they're finished
 # Design question: should we make the user manually mark them done on the notion database and check that?
 # Or ask the user for every task that have passed on the google calendar if it is completed or not
-def parse_passed_tasks():
-    creds = google_auth()
-    service = build("calendar", "v3", credentials=creds)
-    
+def parse_passed_tasks(days: int):
+    # Event IDs saved before the ledger existed have no times, so they are all removed once
     event_ids = config.settings.value(config.EVENT_IDS, [], type=list)
-    
-    for id in event_ids:
-        service.events().delete(calendarId=config.ai_calendar, eventId=id).execute()
-
-# Get tasks from the notion database that is schedulable
-def get_tasks() -> list[list[str]]:
-    if config.notion_client == None:
+    if event_ids:
+        for id in event_ids:
+            journal.enqueue_delete(config.ai_calendar, id)
+        config.settings.remove(config.EVENT_IDS)
+
+    # Only remove the blocks that overlap the days being regenerated
+    start, end = schedule_window(days)
+    blocks = ledger.blocks_in_window(start, end)
+
+    for block in blocks:
+        # Blocks only published in the feed have no Google event
+        if block.calendar_id != icsFeed.CALENDAR_ID:
+            journal.enqueue_delete(block.calendar_id, block.event_id)
+
+    ledger.remove_blocks([block.event_id for block in blocks])
+    ledger.prune(start - timedelta(days=config.ledger_retention_days))
+
+# Get the schedulable tasks of every task source, the sources are read concurrently
+# and each task is prepared as soon as it arrives
+def get_tasks(window: tuple[datetime, datetime] | None = None) -> list[Task]:
+    sources = taskSources.available()
+    if not sources:
         return None
-    
+
+    # A missing source would make the plan drop its tasks, so a failed source fails the whole read
+    found = {}
     try:
-        my_page = config.notion_client.databases.query(
-            **{
-                "database_id": config.database_id,
-                "filter": {
-                    "and": [
-                        {
-                            "property": "Status",
-                            "status": {
-                                "does_not_equal": "Done",
-                            }
-                        },
-                        {
-                            "property": "Schedulable",
-                            "checkbox": {
-                                "equals": True,
-                            },
-                        }
-                    ]
-                }
-            }
-        )
-    except errors.HTTPResponseError():
+        for rank, task in taskSources.merge(sources):
+            # Reuse the model's earlier estimate so the task is not estimated again
+            if task.duration == "N/A":
+                minutes = durationCache.lookup(task.id, task.title)
+                if minutes is not None:
+                    task.duration = durationCache.format_minutes(minutes)
+
+            found[taskSources.task_key(task)] = (rank, task)
+    except taskSources.TaskSourceError as error:
+        print(error)
         return None
 
-    results = my_page["results"]
-
-    # Extract the title and priority of each task
-    tasks = []
-    for i in range(len(results)):
-        title = results[i]['properties']['Title']['title'][0]['plain_text']
-        priority = results[i]['properties']['Priority']['select']
-        duration = results[i]['properties']['Duration']['select']
-        
-        # If the user has not set a priority, set it to 0
-        if priority == None:
-            priority = "N/A"
-        else:
-            priority = priority['name']
-        
-        if duration == None:
-            duration = "N/A"
-        else:
-            duration = duration['name']
-        
-        # Append the task and its priority to the list
-        tasks.append([title, priority, duration])
+    # Skip tasks that are already placed on a block that has not passed yet
+    tasks = [task for rank, task in sorted(found.values(), key=lambda item: item[0]) if not has_valid_placement(task, window)]
 
     # Sort tasks by priority in descending order
-    tasks.sort(key=lambda x: x[1], reverse=True)
+    tasks.sort(key=lambda task: task.priority, reverse=True)
 
     return tasks
 
+# A task is placed if its planned time has not passed and its blocks are still on the calendar
+# Blocks inside the window being planned do not count, they are about to be replaced
+def has_valid_placement(task: Task, window: tuple[datetime, datetime] | None = None) -> bool:
+    if task.scheduled_end is None or task.scheduled_end <= cassette.now().astimezone():
+        return False
+
+    for block in ledger.blocks_for_task(task.id):
+        if window is not None and block.start < window[1].astimezone() and block.end > window[0].astimezone():
+            continue
+        if block.end > cassette.now().astimezone():
+            return True
+    return False
+
 # Get all the free intervals for when the user is free
 def find_free_time(days: int) -> list[list[time, time]]:
     days -= 1
     
-    creds = google_auth()
-    
     try:
-        free_times = copy.deepcopy(config.work_hours)
+        now = cassette.now().replace(hour=0, minute=0, second=0, microsecond=0).astimezone().isoformat()
+        timeMax = (cassette.now().replace(hour=23, minute=59, second=59, microsecond=0) + timedelta(days=days)).astimezone().isoformat()            
 
-        for i in range(len(free_times)):
-            free_times[i] = [[free_times[i][0], free_times[i][1]]]
-        
-        now = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0).astimezone().isoformat()
-        timeMax = (datetime.today().replace(hour=23, minute=59, second=59, microsecond=0) + timedelta(days=days)).astimezone().isoformat()            
-
-        for calendar in config.calendars:
-            service = build("calendar", "v3", credentials=creds)
-
-            events_result = (
-                service.events()
-                .list(
-                    calendarId=calendar,
-                    timeMin=now,
-                    timeMax=timeMax,
-                    singleEvents=True,
-                    orderBy="startTime",
-                )
-                .execute()
-            )
-            events = events_result.get("items", [])
-
-            # Start from the time it is now
-            intervals = free_times[datetime.today().weekday()]
-            interval = intervals[0]
-            
-            if config.debug_time_starts_at_beginning_of_day:
-                time_now = time(0, 0, 0)
-            else:
-                time_now = time(datetime.now().hour, datetime.now().minute, 0)
-            
-            # If the interval is before the current time, remove it
-            if interval[1] < time_now:
-                intervals.remove(interval)    
-            elif interval[0] < time_now:
-                if time_now.minute > 45:
-                    # if time_now.hour == 23:
-                    #     interval[0] = time(0, 0, 0)
-                    interval[0] = time(time_now.hour + 1, 0, 0)
-                else:
-                    for n in [15, 30, 45]:
-                        if time_now.minute < n:
-                            interval[0] = time(time_now.hour, n, 0)
-                            break
-
-            # Going through each event and seeing if it within the interval, then if it is then break the interval down into 2 intervals
-            for event in events:
-                start = datetime.fromisoformat(event["start"].get("dateTime", event["start"].get("date")))
-                end = datetime.fromisoformat(event["end"].get("dateTime", event["end"].get("date")))
-
-                i = start.weekday()
-
-                free_time = free_times[i]
-                for (i, interval) in enumerate(free_time):
-                    # 1. Event ends before interval
-                    if end.time() <= interval[0]:
-                        continue
-
-                    # 2. Event starts after interval
-                    elif start.time() >= interval[1]:
-                        continue
-
-                    # 3. Event starts before interval and ends in the middle of the interval
-                    elif start.time() < interval[0] and end.time() <= interval[1]:
-                        interval[0] = time(end.hour, end.minute, 0)
-                        break
-                    
-                    # 4. Event starts in the middle of the interval and ends after the interval
-                    elif start.time() < interval[1] and end.time() >= interval[1]:
-                        interval[1] = time(start.hour, start.minute, 0)
-                        break
-                    
-                    # 5. Event starts in the middle of the interval and ends in the middle of the interval
-                    elif start.time() > interval[0] and end.time() < interval[1]:
-                        new_interval = [time(end.hour, end.minute, 0), interval[1]]
-                        interval[1] = time(start.hour, start.minute, 0)
-                        free_time.insert(i + 1, new_interval)
-                    
-                    # 6. Event overlaps the entire interval
-                    else:
-                        free_time.pop(i)
-
-        # Change all of the time objects to datetime objects and add the day that it is on
-        for day in range(len(free_times)):
-            i = (day + datetime.now().weekday()) % len(free_times)
-            for intervals in free_times[i]:
-                intervals[0] = datetime.combine(datetime.today() + timedelta(days=day), intervals[0])
-                intervals[1] = datetime.combine(datetime.today() + timedelta(days=day), intervals[1])
-
-        # Remove all intervals that are less than 15 minutes
-        for day in free_times:
-            if len(day) > 2:
-                for i in range(len(day) - 1, -1, -1):
-                    interval = day[i]
-                    start_time = interval[0]
-                    end_time = interval[1]
-                    
-                    travel_time = config.travel_time
-                    
-                    # Remove intervals that are less than 2 * the travel time that user has specified, default is 30 minutes
-                    if end_time - start_time <= timedelta(minutes=travel_time*2 + 30):
-                        day.pop(i)
-                        continue
-
-        # Add travel_time for each event
-        for day in free_times:
-            for i in range(1, len(day) - 1):
-                interval = day[i]
-                
-                interval[0] = interval[0] + timedelta(minutes=travel_time)
-                interval[1] = interval[1] - timedelta(minutes=travel_time)
-        
-        # Add commute_times for each event
-        for day in free_times:
-            if len(day) > 2:
-                start_interval = day[0]
-                end_interval = day[-1]
-                
-                start_interval[1] = start_interval[1] - timedelta(minutes=config.commute_time)
-                end_interval[0] = end_interval[0] + timedelta(minutes=config.commute_time)
+        busy = busy_times(now, timeMax)
+
+        # Kept so that other settings can be tried out without reading the calendars again
+        whatIf.remember_busy(days + 1, busy, cassette.now())
+
+        free_times = freeTime.free_times(
+            busy,
+            config.work_hours,
+            config.travel_time,
+            config.commute_time,
+            cassette.now(),
+            config.debug_time_starts_at_beginning_of_day,
+        )
         
         # Print the free times for debugging purposes
         if config.debug:
@@ -273,18 +307,54 @@ def find_free_time(days: int) -> list[list[time, time]]:
     
     return None
 
+# Fetch the events of every calendar of every account concurrently and merge them into one busy timeline
+def busy_times(time_min: str, time_max: str) -> list[tuple[datetime, datetime]]:
+    credentials = {account: google_auth(account) for account in config.google_accounts}
+
+    def list_events(account_calendar):
+        account, calendar = account_calendar
+        service = build("calendar", "v3", credentials=credentials[account])
+        return googleFetch.list_events(service, calendar, time_min, time_max)
+
+    intervals = []
+    for events in googleFetch.map_concurrently(list_events, calendar_list()):
+        for event in events:
+            # Events marked as free do not block any time
+            if event.get("transparency") == "transparent":
+                continue
+
+            # All day events have no times and never blocked the work hours
+            if "dateTime" not in event["start"] or "dateTime" not in event["end"]:
+                continue
+
+            # Calendars can be in different timezones, compare everything in local time
+            start = datetime.fromisoformat(event["start"]["dateTime"]).astimezone()
+            end = datetime.fromisoformat(event["end"]["dateTime"]).astimezone()
+            intervals.append((start, end))
+
+    intervals.sort()
+
+    busy = []
+    for start, end in intervals:
+        if busy and start <= busy[-1][1]:
+            busy[-1] = (busy[-1][0], max(busy[-1][1], end))
+        else:
+            busy.append((start, end))
+    return busy
+
 # Get the times that is going to be occupied from the AI model
-def find_task_times(days: int, tasks: list[list[str, str]], free_times: list[list[time, time]]) -> list[Event]:
-    if free_times == None or tasks == None:
+def find_task_times(days: int, tasks: list[Task], free_times: list[list[time, time]]) -> list[Event]:
+    # Nothing to ask the model about
+    if free_times == None or not tasks:
         return
 
     task_list = ""
     for i in range(len(tasks)):
-        task_list += f"{i}. {tasks[i][0]}, Priority: {tasks[i][1]}, Duration: {tasks[i][2]}\n"
+        task_list += f"{i}. {tasks[i].title}, Priority: {tasks[i].priority}, Duration: {tasks[i].duration}\n"
 
     free_time_list = ""
     for day in range(days):
-        i = (day + datetime.today().weekday()) % len(free_times)
+        i = (day + cassette.now().weekday()) % len(free_times)
         
         free_time_list += f"Day {day + 1}:\n"
         for interval in free_times[i]:
@@ -302,6 +372,7 @@ Predict task durations and provide start/end times in ISO format.
 - **Do not exceed free time intervals.**  
 - **If placing tasks at the day's start/end, prefer earlier slots.**  
 - **Keep flexibility** for unexpected changes.  
+- **Set estimated_minutes** to the whole task's estimated duration, the same on every part, even if not all of it fits.  
 
 **Tasks to schedule:**  
 {task_list}  
@@ -313,18 +384,9 @@ Predict task durations and provide start/end times in ISO format.
         if config.debug:
             print(gemini_prompt)
 
-        response = config.gemini_client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=gemini_prompt,
-            config={
-                'response_mime_type': 'application/json',
-                'response_schema': list[Event],
-            },
-        ).parsed
+        response = rateLimiter.call("gemini", ask_gemini, gemini_prompt)
     
     else:
-        from openai import OpenAI
-        
         system_prompt = """
 You are a personal assistant that schedules tasks efficiently within the user's free time.  
 Predict task durations and provide start/end times in ISO format.  
@@ -336,6 +398,7 @@ Predict task durations and provide start/end times in ISO format.
 6. If a task is too large for a single interval, break it into smaller segments that fit into separate free time intervals.
 7. Do not schedule tasks outside the provided free time intervals.
 9. Optimize overall time allocation while allowing for flexibility.
+10. Set estimated_minutes to the whole task's estimated duration, the same on every part of a split task, even if not all of it fits.
     """
 
         user_prompt = f"""
@@ -350,18 +413,10 @@ Here are the user's available free time slots:
             print(system_prompt)
             print(user_prompt)
         
-        client = OpenAI(api_key=config.settings.value(config.CHATGPT_KEY, "", type=str))
-        
-        response = client.beta.chat.completions.parse(
-            model="gpt-4o-mini-2024-07-18",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format=Events,
-        )
-        
-        response = response.choices[0].message.parsed.events
+        response = rateLimiter.call("openai", ask_openai, system_prompt, user_prompt)
+
+    # Replayed responses come back as plain dictionaries
+    response = [Event.model_validate(event) for event in response]
     
     if config.debug:
         for i in range(len(response)):
@@ -372,55 +427,181 @@ Here are the user's available free time slots:
     
     return response
 
-# Schedule the AI Tasks events on the AI Tasks Calendar
-def schedule_tasks_on_calendar(events: list[Event]):
-    if len(events) == 0:
+def ask_gemini(prompt: str) -> list[Event]:
+    return config.get_gemini_client().models.generate_content(
+        model="gemini-2.0-flash",
+        contents=prompt,
+        config={
+            'response_mime_type': 'application/json',
+            'response_schema': list[Event],
+        },
+    ).parsed
+
+def ask_openai(system_prompt: str, user_prompt: str) -> list[Event]:
+    from openai import OpenAI
+
+    # The shared limiter is the only layer that retries
+    client = OpenAI(api_key=config.settings.value(config.CHATGPT_KEY, "", type=str), max_retries=0)
+
+    response = client.beta.chat.completions.parse(
+        model="gpt-4o-mini-2024-07-18",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        response_format=Events,
+    )
+
+    return response.choices[0].message.parsed.events
+
+# Cache the durations the model estimated for tasks that did not have one
+# The placed blocks are not used, a task that did not fit in the window gets less time than it needs
+def remember_estimates(events: list[Event], tasks: list[Task]):
+    if not events or not tasks:
+        return
+
+    estimates = {}
+    for event in events:
+        task = match_task(event.title, tasks)
+        if task is None or task.duration != "N/A" or not event.estimated_minutes:
+            continue
+
+        title, minutes = estimates.get(task.id, (task.title, 0))
+        estimates[task.id] = (title, max(minutes, event.estimated_minutes))
+
+    durationCache.store({task_id: (title, minutes) for task_id, (title, minutes) in estimates.items() if minutes > 0})
+
+# Schedule the AI Tasks events on the AI Tasks Calendar, the inserts are journaled and sent in the background
+# In ics mode the blocks are only kept in the ledger and published in the feed
+# Returns where each task was placed as page ID -> (start, end, event ID of the first block)
+def schedule_tasks_on_calendar(events: list[Event], tasks: list[Task]) -> dict[str, tuple[datetime, datetime, str]]:
+    placements = {}
+
+    if not events:
         print("No events to schedule")
+        return placements
     
-    event_id = []
+    plan_version = ledger.next_plan_version()
+    calendar_id = icsFeed.CALENDAR_ID if config.output_mode == "ics" else config.ai_calendar
     
-    for event in events:
-        creds = google_auth()
-        service = build("calendar", "v3", credentials=creds)
-        
-        event = {
+    for (i, event) in enumerate(events):
+        body = {
             "summary": event.title,
             "start": {"dateTime": event.start, "timeZone": get_localzone().key},
             "end": {"dateTime": event.end, "timeZone": get_localzone().key},
         }
 
-        event_id.append(service.events().insert(calendarId=config.ai_calendar, body=event).execute().get("id"))
+        # The ID is chosen here so the block can be tracked before Google has seen it
+        event_id = new_event_id(calendar_id, i, event)
+        if calendar_id != icsFeed.CALENDAR_ID:
+            journal.enqueue_insert(calendar_id, event_id, body)
+
+        start = datetime.fromisoformat(event.start).astimezone()
+        end = datetime.fromisoformat(event.end).astimezone()
+
+        task = match_task(event.title, tasks)
+        ledger.add_block(
+            event_id,
+            calendar_id,
+            task.id if task else None,
+            event.title,
+            start,
+            end,
+            plan_version,
+        )
+
+        if task is None:
+            continue
+
+        # A task split into several blocks spans from its first to its last block
+        if task.id in placements:
+            first_start, last_end, first_event_id = placements[task.id]
+            if start < first_start:
+                first_start, first_event_id = start, event_id
+            placements[task.id] = (first_start, max(last_end, end), first_event_id)
+        else:
+            placements[task.id] = (start, end, event_id)
+
+    return placements
+
+# Google accepts client chosen event IDs made of lowercase hex digits, unique per run and block
+def new_event_id(calendar_id: str, index: int, event: Event) -> str:
+    seed = f"{calendar_id}|{cassette.now().isoformat()}|{index}|{event.title}|{event.start}"
+    return hashlib.sha1(seed.encode("utf-8")).hexdigest()
+
+# Find the task an event was planned for, the model may split a task into parts like "Task 1/2"
+def match_task(title: str, tasks: list[Task]) -> Task | None:
+    title = re.sub(r"\s*\(?(part\s*)?\d+\s*/\s*\d+\)?$", "", title.strip(), flags=re.IGNORECASE).strip()
+
+    for task in tasks or []:
+        if task.title.strip() == title:
+            return task
     
-    config.settings.setValue(config.EVENT_IDS, event_id)    
+    for task in tasks or []:
+        if task.title.strip().lower() == title.lower():
+            return task
+    return None
+
+
+# Each account keeps its own credential cache, the default account uses token.json
+def token_path(account: str) -> str:
+    if account == config.DEFAULT_ACCOUNT:
+        return "token.json"
+    return f"token-{re.sub(r'[^A-Za-z0-9_-]', '_', account)}.json"
 
+# Accounts are authorised from several threads at once, refreshing a token must not race
+auth_lock = threading.Lock()
+
+# Threads that must never wait for the user, like the pre-planner, set interactive to False
+# so that google_auth raises instead of opening the sign in flow
+background = threading.local()
+
+class GoogleAuthRequired(GoogleAuthError):
+    pass
+
+def google_auth(account: str = config.DEFAULT_ACCOUNT, interactive: bool | None = None):
+    # Replayed requests never reach Google, the service only has to be buildable offline
+    if cassette.mode == "replay":
+        return AnonymousCredentials()
+
+    if interactive is None:
+        interactive = getattr(background, "interactive", True)
 
-def google_auth():
     SCOPES = ["https://www.googleapis.com/auth/calendar"]
+    token_file = token_path(account)
     run = True
     
-    while run == True:
-        try:
-            creds = None
-    
-            if os.path.exists("token.json"):
-                creds = Credentials.from_authorized_user_file("token.json")
+    with auth_lock:
+        while run == True:
+            try:
+                creds = None
+        
+                if os.path.exists(token_file):
+                    creds = Credentials.from_authorized_user_file(token_file)
     
-            if not creds or not creds.valid:
-                if creds and creds.expired and creds.refresh_token:
-                    creds.refresh(Request())
-                else:
-                    print("string: " + config.settings.value(config.GOOGLE_AUTH, "", type=str))
+                if not creds or not creds.valid:
+                    if creds and creds.expired and creds.refresh_token:
+                        creds.refresh(Request())
+                    else:
+                        if not interactive:
+                            raise GoogleAuthRequired(f"{token_file} is missing or invalid, sign in from the settings")
+
+                        print("string: " + config.settings.value(config.GOOGLE_AUTH, "", type=str))
+
+                        flow = InstalledAppFlow.from_client_secrets_file(
+                            config.settings.value(config.GOOGLE_AUTH, "", type=str), SCOPES
+                        )
 
-                    flow = InstalledAppFlow.from_client_secrets_file(
-                        config.settings.value(config.GOOGLE_AUTH, "", type=str), SCOPES
-                    )
+                        creds = flow.run_local_server(port=0)
+                    with open(token_file, "w") as token:
+                        token.write(creds.to_json())
 
-                    creds = flow.run_local_server(port=0)
-                with open("token.json", "w") as token:
-                    token.write(creds.to_json())
+                run = False
+            except RefreshError as error:
+                # The token is kept for the next interactive sign in to replace
+                if not interactive:
+                    raise GoogleAuthRequired(f"Refreshing {token_file} failed: {error}") from error
 
-            run = False
-        except RefreshError as error:
-            os.remove("token.json")
-            print("Refresh error, token.json removed")
+                os.remove(token_file)
+                print(f"Refresh error, {token_file} removed")
     return creds
\ No newline at end of file
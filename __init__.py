@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 
 from PySide6 import QtGui, QtWidgets
@@ -7,6 +8,9 @@ from utils import resource_path
 
 # Entry point for the application
 if __name__ == "__main__":
+    # Packaged builds start the simulation workers from this executable
+    multiprocessing.freeze_support()
+
     # Create the application
     app = QtWidgets.QApplication(sys.argv)
 
@@ -0,0 +1,42 @@
+# Idle RSS of the tray process before and after a regeneration, and after trimming
+# Replays a recorded run so it needs no network:
+#   python cassette.py record week.cassette --days 7
+#   python benchmarks/memoryBench.py week.cassette --days 7
+import argparse
+import gc
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cassette
+import memoryBudget
+
+def snapshot(label: str):
+    gc.collect()
+    print(f"{label}\n{memoryBudget.report()}\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure idle RSS around a replayed regeneration")
+    parser.add_argument("cassette")
+    parser.add_argument("--days", type=int, default=7)
+    options = parser.parse_args()
+
+    # What the tray has loaded before anything was regenerated
+    import AI
+    import journal
+    import prePlanner
+
+    snapshot("Idle before regeneration")
+
+    cassette.start("replay", options.cassette)
+    try:
+        AI.auto_schedule_tasks(options.days)
+        journal.drain()
+    finally:
+        cassette.stop()
+
+    snapshot("Idle after regeneration")
+
+    memoryBudget.trim()
+    snapshot("Idle after trimming")
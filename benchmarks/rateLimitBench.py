@@ -0,0 +1,83 @@
+# Benchmark the shared rate limiter against a fake server that injects 429s
+# Run from the repository root: python benchmarks/rateLimitBench.py
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rateLimiter
+
+REQUESTS = 300
+CLIENT_THREADS = 16
+SERVER_RATE = 25  # requests per second the fake server accepts
+SERVER_BURST = 5
+LATENCY = 0.01
+
+class ThrottledError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("429 Too Many Requests")
+        self.status_code = 429
+        self.headers = {"Retry-After": str(retry_after)}
+
+# Server side quota, anything over it gets a 429 with a Retry-After hint
+class FakeServer:
+    def __init__(self):
+        self.bucket = rateLimiter.TokenBucket(SERVER_RATE, SERVER_BURST)
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def handle(self):
+        time.sleep(LATENCY)
+        with self.bucket.lock:
+            now = time.monotonic()
+            self.bucket.tokens = min(self.bucket.capacity, self.bucket.tokens + (now - self.bucket.updated) * self.bucket.rate)
+            self.bucket.updated = now
+            if self.bucket.tokens >= 1:
+                self.bucket.tokens -= 1
+                return {"ok": True}
+        with self.lock:
+            self.rejected += 1
+        raise ThrottledError(1 / SERVER_RATE)
+
+# What the code did before: fire immediately and give up on the first failure
+def naive(server: FakeServer):
+    try:
+        return server.handle()
+    except ThrottledError:
+        return None
+
+# Retrying straight away hammers the server without getting more work done
+def retry(server: FakeServer):
+    for _ in range(6):
+        try:
+            return server.handle()
+        except ThrottledError:
+            continue
+    return None
+
+def limited(server: FakeServer):
+    try:
+        return rateLimiter.call("fake", server.handle)
+    except ThrottledError:
+        return None
+
+def run(name: str, client):
+    server = FakeServer()
+    start = time.monotonic()
+    with ThreadPoolExecutor(CLIENT_THREADS) as pool:
+        results = list(pool.map(lambda _: client(server), range(REQUESTS)))
+    elapsed = time.monotonic() - start
+
+    succeeded = sum(result is not None for result in results)
+    print(f"{name:>8}: {succeeded}/{REQUESTS} succeeded, {server.rejected} rejected, "
+          f"{elapsed:.2f}s, {succeeded / elapsed:.1f} successful req/s")
+
+if __name__ == "__main__":
+    # Start well above the server quota so the limiter has to adapt
+    rateLimiter.configure("fake", SERVER_RATE * 2, SERVER_BURST, CLIENT_THREADS)
+    run("naive", naive)
+    run("retry", retry)
+    run("limited", limited)
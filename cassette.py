@@ -0,0 +1,288 @@
+import argparse
+import cProfile
+import gzip
+import json
+import os
+import pstats
+import sqlite3
+import tempfile
+import threading
+import time as clock
+from datetime import datetime, time
+
+from pydantic import BaseModel
+
+import config
+
+# Record every Google, Notion and LLM call of a scheduling run into a gzipped cassette,
+# then replay the same run offline with a pinned clock and optional injected latency
+mode = None  # None, "record" or "replay"
+path = ""
+latency = 0.0
+strict = True
+
+recorded_now = None
+header = {}
+interactions = []
+lock = threading.Lock()
+
+class CassetteMissError(LookupError):
+    pass
+
+# Error replayed for services whose own error type cannot be rebuilt
+class ReplayedError(Exception):
+    def __init__(self, message: str, status: int | None):
+        super().__init__(message)
+        self.status = status
+
+# Settings that change the prompt or the free time, restored on replay
+def snapshot_config() -> dict:
+    return {
+        "work_hours": [[hours[0].isoformat(), hours[1].isoformat()] for hours in config.work_hours],
+        "travel_time": config.travel_time,
+        "commute_time": config.commute_time,
+        "use_gemini": config.use_gemini,
+        "database_id": config.database_id,
+        "google_accounts": config.google_accounts,
+        "task_sources": config.task_sources,
+        "output_mode": config.output_mode,
+        "notion": config.get_notion_client() is not None,
+    }
+
+def restore_config(snapshot: dict):
+    config.work_hours = [[time.fromisoformat(start), time.fromisoformat(end)] for start, end in snapshot["work_hours"]]
+    config.travel_time = snapshot["travel_time"]
+    config.commute_time = snapshot["commute_time"]
+    config.use_gemini = snapshot["use_gemini"]
+    config.database_id = snapshot["database_id"]
+    config.google_accounts = snapshot.get("google_accounts", [config.DEFAULT_ACCOUNT])
+    config.output_mode = snapshot.get("output_mode", "calendar")
+    config.task_sources = snapshot.get("task_sources", [{"type": "notion", "database_id": config.database_id}])
+
+    if snapshot["notion"]:
+        from notion_client import Client as NotionClient
+
+        # Never used to send requests, replay answers them before they reach the client
+        config.notion_client = NotionClient(auth="replay")
+    else:
+        config.notion_client = None
+
+# Stored settings that a run reads besides config, API keys are never recorded
+# The calendar list caches decide whether the recorded list request was conditional
+def snapshot_settings() -> dict:
+    keys = [
+        key for key in config.settings.allKeys()
+        if key == config.EVENT_IDS or key == config.CALENDAR_LIST_CACHE or key.startswith(config.CALENDAR_LIST_CACHE + "/")
+    ]
+    return {key: config.settings.value(key) for key in keys}
+
+# Replay reads and writes a throwaway settings file so the user's app state is never touched
+def restore_settings(values: dict):
+    from PySide6 import QtCore
+
+    config.settings = QtCore.QSettings(os.path.join(config.data_dir, "settings.ini"), QtCore.QSettings.IniFormat)
+    config.settings.clear()
+    for key, value in values.items():
+        config.settings.setValue(key, value)
+
+# The ledger decides which blocks are deleted and which tasks are planned, so it is part of the recording
+def snapshot_ledger() -> list[str]:
+    import ledger
+
+    with ledger.lock:
+        return list(ledger.connect().iterdump())
+
+def restore_ledger(statements: list[str]):
+    import durationCache
+    import journal
+    import ledger
+
+    # Replay works on a throwaway copy so the user's ledger is never touched
+    config.data_dir = tempfile.mkdtemp(prefix="aicalendar-replay-")
+    ledger.connection = None
+    durationCache.initialized = False
+    journal.initialized = False
+
+    db = sqlite3.connect(os.path.join(config.data_dir, "ledger.sqlite3"))
+    db.executescript(";\n".join(statement.rstrip(";") for statement in statements))
+    db.close()
+
+def start(new_mode: str, new_path: str, new_latency: float = 0.0, new_strict: bool = True):
+    global mode, path, latency, strict, recorded_now, interactions
+
+    path = new_path
+    latency = new_latency
+    strict = new_strict
+
+    if new_mode == "record":
+        from tzlocal import get_localzone
+
+        recorded_now = datetime.now().replace(microsecond=0)
+        interactions = []
+        header["now"] = recorded_now.isoformat()
+        header["timezone"] = get_localzone().key
+        header["config"] = snapshot_config()
+        header["ledger"] = snapshot_ledger()
+        header["settings"] = snapshot_settings()
+    elif new_mode == "replay":
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            data = json.load(file)
+
+        header.update({key: value for key, value in data.items() if key != "interactions"})
+        interactions = data["interactions"]
+        for interaction in interactions:
+            interaction["used"] = False
+
+        recorded_now = datetime.fromisoformat(data["now"])
+
+        # Local times are compared against the recorded responses, so use the recorded timezone
+        if hasattr(clock, "tzset"):
+            os.environ["TZ"] = data["timezone"]
+            clock.tzset()
+
+        restore_config(data["config"])
+        restore_ledger(data["ledger"])
+        restore_settings(data.get("settings", {}))
+    else:
+        raise ValueError(f"Unknown cassette mode: {new_mode}")
+
+    mode = new_mode
+
+def stop():
+    global mode
+
+    if mode == "record":
+        with gzip.open(path, "wt", encoding="utf-8") as file:
+            json.dump({**header, "interactions": interactions}, file, separators=(",", ":"))
+    mode = None
+
+# The time the app plans around, pinned to the recording time while recording and replaying
+def now() -> datetime:
+    if mode is not None:
+        return recorded_now
+    return datetime.now()
+
+# Identify a request independently of the objects that made it
+def request_key(fn, args, kwargs) -> str:
+    request = getattr(fn, "__self__", None)
+    if request is not None and hasattr(request, "uri"):  # googleapiclient HttpRequest
+        return f"{request.method} {request.uri} {request.body or ''}"
+
+    name = f"{getattr(fn, '__module__', '')}.{getattr(fn, '__qualname__', repr(fn))}"
+    return f"{name} {json.dumps([args, kwargs], sort_keys=True, default=to_json)}"
+
+def to_json(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+# Run perform() and record its outcome, or answer from the cassette on replay
+def call(service: str, fn, args, kwargs, perform):
+    key = request_key(fn, args, kwargs)
+
+    if mode == "replay":
+        return replay(service, key)
+
+    started = clock.perf_counter()
+    interaction = {"service": service, "key": key}
+    try:
+        result = perform()
+    except Exception as error:
+        import rateLimiter
+
+        status, _ = rateLimiter.inspect_error(error)
+        content = getattr(error, "content", None) or getattr(error, "body", None) or ""
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", "replace")
+
+        interaction["error"] = {"status": status, "message": str(error), "content": content}
+        interaction["elapsed"] = clock.perf_counter() - started
+        with lock:
+            interactions.append(interaction)
+        raise
+
+    interaction["response"] = to_json(result)
+    interaction["elapsed"] = clock.perf_counter() - started
+    with lock:
+        interactions.append(interaction)
+    return result
+
+def replay(service: str, key: str):
+    with lock:
+        match = next((item for item in interactions if not item["used"] and item["key"] == key), None)
+
+        # Loose matching lets a changed prompt still replay the next recorded answer of that service
+        if match is None and not strict:
+            match = next((item for item in interactions if not item["used"] and item["service"] == service), None)
+        if match is None:
+            raise CassetteMissError(f"No recorded {service} response for {key}")
+
+        match["used"] = True
+
+    if latency:
+        clock.sleep(latency)
+
+    if "error" in match:
+        raise rebuild_error(service, key, match["error"])
+    return match["response"]
+
+def rebuild_error(service: str, key: str, error: dict) -> Exception:
+    status = error["status"] or 500
+
+    if service == "google":
+        import httplib2
+        from googleapiclient.errors import HttpError
+
+        return HttpError(httplib2.Response({"status": status}), error["content"].encode("utf-8"), uri=key.split(" ")[1])
+    if service == "notion":
+        import httpx
+        from notion_client import errors
+
+        return errors.HTTPResponseError(httpx.Response(status, text=error["content"]), error["message"])
+    return ReplayedError(error["message"], status)
+
+# Record or replay a scheduling run from the command line, optionally under the profiler
+def main():
+    parser = argparse.ArgumentParser(description="Record or replay the API traffic of a scheduling run")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("path")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every replayed call")
+    parser.add_argument("--loose", action="store_true", help="replay the next response of a service when a request does not match")
+    parser.add_argument("--profile", action="store_true")
+    options = parser.parse_args()
+
+    start(options.mode, options.path, options.latency, not options.loose)
+
+    import AI
+    import journal
+
+    # Send the journal in the foreground so its calls are part of the run
+    def run():
+        AI.auto_schedule_tasks(options.days)
+        journal.drain()
+
+    profiler = cProfile.Profile() if options.profile else None
+    started = clock.perf_counter()
+    try:
+        if profiler:
+            profiler.runcall(run)
+        else:
+            run()
+    finally:
+        stop()
+
+    print(f"{options.mode} finished in {clock.perf_counter() - started:.3f}s")
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+if __name__ == "__main__":
+    # Go through the imported module so the rest of the app sees the same cassette state
+    import cassette
+    cassette.main()
@@ -1,7 +1,7 @@
+import json
+import os
 from datetime import time
 
-from google import genai
-from notion_client import Client as NotionClient
 from PySide6 import QtCore
 
 LIGHT_MODE_KEY = "light_mode"
@@ -12,45 +12,127 @@ NOTION_TOKEN = "notion_token"
 WORK_HOURS = "work_hours"
 USE_GEMINI = "use_gemini"
 EVENT_IDS = "event_ids"
+CALENDAR_LIST_CACHE = "calendar_list_cache"
+IDLE_TRIM_MINUTES = "idle_trim_minutes"
+GOOGLE_ACCOUNTS = "google_accounts"
+TASK_SOURCES = "task_sources"
+TRAVEL_TIME = "travel_time"
+COMMUTE_TIME = "commute_time"
+OUTPUT_MODE = "output_mode"
+ICS_PORT = "ics_port"
 
 # Qt decides where to store the settings based on the OS
 settings = QtCore.QSettings("Yash", "AICalendar")
 
+# Local data such as the ledger of scheduled blocks
+data_dir = os.path.join(QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.GenericDataLocation), "AICalendar")
+os.makedirs(data_dir, exist_ok=True)
+
 work_hours = settings.value(WORK_HOURS, [[time(7, 0, 0).isoformat(), time(22, 0, 0).isoformat()]] * 7, type=list)
 # Convert the strings to time objects
 for hours in work_hours:
     hours[0] = time.fromisoformat(hours[0])
     hours[1] = time.fromisoformat(hours[1])
 
+# The client libraries are imported on first use so that an idle tray can drop them again
 def create_gemini_client():
     api_key = settings.value(GEMINI_KEY, None)
     if api_key:
+        from google import genai
+
         return genai.Client(api_key=api_key)
     return None
 
 def create_notion_client():
     auth_token = settings.value(NOTION_TOKEN, None)
     if auth_token:
+        from notion_client import Client as NotionClient
+
         return NotionClient(auth=auth_token)
     return None
 
-# Create clients
-gemini_client = create_gemini_client()
-notion_client = create_notion_client()
+# Clients are created when first needed and may be dropped while idle
+gemini_client = None
+notion_client = None
+
+def get_gemini_client():
+    global gemini_client
+
+    if gemini_client is None:
+        gemini_client = create_gemini_client()
+    return gemini_client
+
+def get_notion_client():
+    global notion_client
+
+    if notion_client is None:
+        notion_client = create_notion_client()
+    return notion_client
 
 # Notion Database
 database_id = "6728f8a2330a4092860d6d358a4c33f3"
 
+# Where tasks are read from, e.g. {"type": "notion", "database_id": ...}, {"type": "markdown", "path": ...}
+# or {"type": "csv", "path": ...}, tasks found in several sources are taken from the first
+task_sources = json.loads(settings.value(TASK_SOURCES, json.dumps([{"type": "notion", "database_id": database_id}]), type=str))
+
+# Properties that the planned time and calendar link are written back to
+scheduled_property = "Scheduled"
+event_link_property = "Calendar Event"
+writeback_workers = 3
+
 # Google Calendar
+# Every account has its own token, the default account holds the AI Tasks calendar
+DEFAULT_ACCOUNT = "default"
+google_accounts = settings.value(GOOGLE_ACCOUNTS, [DEFAULT_ACCOUNT], type=list)
+
+# (account, calendar ID) of every calendar whose events block time
 calendars = []
 ai_calendar = ""
 
+# "calendar" puts the plan on the AI Tasks calendar, "ics" only publishes it as a feed on localhost
+output_mode = settings.value(OUTPUT_MODE, "calendar", type=str)
+ics_port = settings.value(ICS_PORT, 8765, type=int)
+
 # in minutes
-travel_time = 10
-commute_time = 30
+travel_time = settings.value(TRAVEL_TIME, 10, type=int)
+commute_time = settings.value(COMMUTE_TIME, 30, type=int)
 
 use_gemini = settings.value(USE_GEMINI, True, type=bool)
 
+# Client-side rate limits per service: (requests per second, burst size, max concurrent requests)
+rate_limits = {
+    "google": (10, 10, 4),
+    "notion": (3, 3, 3),
+    "gemini": (0.25, 2, 1),
+    "openai": (1, 3, 2),
+    # Local task files are read through the limiter only so that cassettes record them
+    "files": (50, 50, 4),
+}
+
+# Plans for these horizons (in days) are prepared in the background every preplan_interval seconds
+preplan_horizons = (1, 3, 7)
+preplan_interval = 600
+
+# Blocks that ended more than this many days ago are removed from the ledger
+ledger_retention_days = 30
+
+# Calendar changes are sent in batches of up to 50, retried on this interval (seconds) while offline
+journal_batch_size = 50
+journal_retry_interval = 60
+
+# Retries for throttled or failed requests, backoff in seconds
+max_retries = 5
+backoff_base = 0.5
+backoff_cap = 32
+
+# Processes that simulate other settings in the settings window
+what_if_workers = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+# Drop clients and caches after this many idle minutes in the tray
+idle_trim_minutes = settings.value(IDLE_TRIM_MINUTES, 15, type=int)
+
 # DEBUG
 debug = False
+trace_memory = False
 debug_time_starts_at_beginning_of_day = True
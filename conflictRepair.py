@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+from tzlocal import get_localzone
+
+import AI
+import cassette
+import config
+import icsFeed
+import journal
+import ledger
+import notionWriteback
+import taskSources
+
+# Move only the AI blocks that now overlap busy time into the nearest free slot,
+# every other block stays where it is. Returns the event IDs that could not be moved.
+def repair_conflicts(days: int = 7) -> list[str]:
+    AI.check_AI_tasks_calendar()
+    free_times = AI.find_free_time(days)
+    if free_times == None:
+        return []
+
+    now = cassette.now()
+    _, window_end = AI.schedule_window(days)
+    free = sorted((interval[0], interval[1]) for day in free_times for interval in day if interval[1] > now)
+
+    conflicts = []
+    placed = []
+    for block in ledger.blocks_in_window(now, window_end):
+        start, end = local(block.start), local(block.end)
+
+        # Blocks that already started are left alone but still take up their time
+        if start < now or any(free_start <= start and end <= free_end for free_start, free_end in free):
+            placed.append((start, end))
+        else:
+            conflicts.append(block)
+
+    if not conflicts:
+        return []
+
+    # Blocks that stay are busy time for the ones being moved
+    available = subtract(free, placed)
+
+    moved = set()
+    unresolved = []
+    for block in conflicts:
+        start, end = local(block.start), local(block.end)
+        slot = nearest_slot(available, start, end - start)
+        if slot is None:
+            unresolved.append(block.event_id)
+            continue
+
+        available = subtract(available, [slot])
+        if block.calendar_id != icsFeed.CALENDAR_ID:
+            journal.enqueue_patch(block.calendar_id, block.event_id, {
+                "start": {"dateTime": slot[0].astimezone().isoformat(), "timeZone": get_localzone().key},
+                "end": {"dateTime": slot[1].astimezone().isoformat(), "timeZone": get_localzone().key},
+            })
+        ledger.move_block(block.event_id, slot[0], slot[1])
+
+        if block.task_id is not None:
+            moved.add(block.task_id)
+
+    if config.output_mode == "ics":
+        icsFeed.publish()
+
+    # The tasks' planned span in Notion follows their blocks, file tasks only live in the ledger
+    placements = {}
+    for task_id in moved:
+        if taskSources.is_file_task(task_id):
+            continue
+        blocks = ledger.blocks_for_task(task_id)
+        placements[task_id] = (min(block.start for block in blocks), max(block.end for block in blocks), None)
+
+    journal.flush_async(lambda links: notionWriteback.write_back([], placements))
+    return unresolved
+
+# Blocks are stored with a timezone, the free time is in naive local time
+def local(value: datetime) -> datetime:
+    return value.astimezone().replace(tzinfo=None)
+
+# Remove the busy intervals from the sorted free intervals
+def subtract(free: list[tuple[datetime, datetime]], busy: list[tuple[datetime, datetime]]) -> list[tuple[datetime, datetime]]:
+    result = []
+    for free_start, free_end in free:
+        pieces = [(free_start, free_end)]
+        for busy_start, busy_end in busy:
+            next_pieces = []
+            for piece_start, piece_end in pieces:
+                if busy_end <= piece_start or busy_start >= piece_end:
+                    next_pieces.append((piece_start, piece_end))
+                    continue
+                if piece_start < busy_start:
+                    next_pieces.append((piece_start, busy_start))
+                if busy_end < piece_end:
+                    next_pieces.append((busy_end, piece_end))
+            pieces = next_pieces
+        result += pieces
+    return result
+
+# The slot of the given length closest to the original start that fits in a free interval
+def nearest_slot(free: list[tuple[datetime, datetime]], start: datetime, duration: timedelta) -> tuple[datetime, datetime] | None:
+    best = None
+    for free_start, free_end in free:
+        if free_end - free_start < duration:
+            continue
+
+        candidate = min(max(start, free_start), free_end - duration)
+        if best is None or abs(candidate - start) < abs(best - start):
+            best = candidate
+
+    if best is None:
+        return None
+    return best, best + duration
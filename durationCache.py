@@ -0,0 +1,46 @@
+import hashlib
+
+import ledger
+
+# Durations the model estimated for tasks without one, kept per Notion page and
+# invalidated when the title changes
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS durations (
+    task_id TEXT PRIMARY KEY,
+    title_hash TEXT NOT NULL,
+    minutes INTEGER NOT NULL
+);
+"""
+
+initialized = False
+
+def connect():
+    global initialized
+
+    db = ledger.connect()
+    if not initialized:
+        db.executescript(SCHEMA)
+        initialized = True
+    return db
+
+def title_hash(title: str) -> str:
+    return hashlib.sha1(title.strip().encode("utf-8")).hexdigest()
+
+# The cached estimate in minutes, or None if the task is new or its title was edited
+def lookup(task_id: str, title: str) -> int | None:
+    with ledger.lock:
+        row = connect().execute("SELECT title_hash, minutes FROM durations WHERE task_id = ?", (task_id,)).fetchone()
+
+    if row is None or row[0] != title_hash(title):
+        return None
+    return row[1]
+
+def store(estimates: dict[str, tuple[str, int]]):
+    with ledger.lock, connect() as db:
+        db.executemany(
+            "INSERT OR REPLACE INTO durations VALUES (?, ?, ?)",
+            [(task_id, title_hash(title), minutes) for task_id, (title, minutes) in estimates.items()],
+        )
+
+def format_minutes(minutes: int) -> str:
+    return f"{minutes} min"
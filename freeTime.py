@@ -0,0 +1,168 @@
+import copy
+import re
+from datetime import datetime, time, timedelta
+
+# Only the standard library is imported here so that process pool workers start quickly
+
+# Tasks without a duration are assumed to take this long when simulating a plan
+DEFAULT_TASK_MINUTES = 60
+
+# The model never plans blocks shorter than this
+MIN_BLOCK_MINUTES = 15
+
+# Cut the busy timeline out of the work hours, the result has one list of [start, end] per weekday
+# busy holds sorted, merged (start, end) intervals in local time, now is naive local time
+def free_times(busy: list[tuple[datetime, datetime]], work_hours: list[list[time]], travel_time: int, commute_time: int, now: datetime, start_of_day: bool) -> list[list[list[datetime]]]:
+    free_times = copy.deepcopy(work_hours)
+
+    for i in range(len(free_times)):
+        free_times[i] = [[free_times[i][0], free_times[i][1]]]
+
+    # Start from the time it is now
+    intervals = free_times[now.weekday()]
+    interval = intervals[0]
+
+    if start_of_day:
+        time_now = time(0, 0, 0)
+    else:
+        time_now = time(now.hour, now.minute, 0)
+
+    # If the interval is before the current time, remove it
+    if interval[1] < time_now:
+        intervals.remove(interval)
+    elif interval[0] < time_now:
+        if time_now.minute > 45:
+            # if time_now.hour == 23:
+            #     interval[0] = time(0, 0, 0)
+            interval[0] = time(time_now.hour + 1, 0, 0)
+        else:
+            for n in [15, 30, 45]:
+                if time_now.minute < n:
+                    interval[0] = time(time_now.hour, n, 0)
+                    break
+
+    # Going through each busy interval and seeing if it within the interval, then if it is then break the interval down into 2 intervals
+    for (start, end) in busy:
+        i = start.weekday()
+
+        free_time = free_times[i]
+        for (i, interval) in enumerate(free_time):
+            # 1. Event ends before interval
+            if end.time() <= interval[0]:
+                continue
+
+            # 2. Event starts after interval
+            elif start.time() >= interval[1]:
+                continue
+
+            # 3. Event starts before interval and ends in the middle of the interval
+            elif start.time() < interval[0] and end.time() <= interval[1]:
+                interval[0] = time(end.hour, end.minute, 0)
+                break
+
+            # 4. Event starts in the middle of the interval and ends after the interval
+            elif start.time() < interval[1] and end.time() >= interval[1]:
+                interval[1] = time(start.hour, start.minute, 0)
+                break
+
+            # 5. Event starts in the middle of the interval and ends in the middle of the interval
+            elif start.time() > interval[0] and end.time() < interval[1]:
+                new_interval = [time(end.hour, end.minute, 0), interval[1]]
+                interval[1] = time(start.hour, start.minute, 0)
+                free_time.insert(i + 1, new_interval)
+
+            # 6. Event overlaps the entire interval
+            else:
+                free_time.pop(i)
+
+    # Change all of the time objects to datetime objects and add the day that it is on
+    for day in range(len(free_times)):
+        i = (day + now.weekday()) % len(free_times)
+        for intervals in free_times[i]:
+            intervals[0] = datetime.combine(now + timedelta(days=day), intervals[0])
+            intervals[1] = datetime.combine(now + timedelta(days=day), intervals[1])
+
+    # Remove all intervals that are less than 15 minutes
+    for day in free_times:
+        if len(day) > 2:
+            for i in range(len(day) - 1, -1, -1):
+                interval = day[i]
+                start_time = interval[0]
+                end_time = interval[1]
+
+                # Remove intervals that are less than 2 * the travel time that user has specified, default is 30 minutes
+                if end_time - start_time <= timedelta(minutes=travel_time*2 + 30):
+                    day.pop(i)
+                    continue
+
+    # Add travel_time for each event
+    for day in free_times:
+        for i in range(1, len(day) - 1):
+            interval = day[i]
+
+            interval[0] = interval[0] + timedelta(minutes=travel_time)
+            interval[1] = interval[1] - timedelta(minutes=travel_time)
+
+    # Add commute_times for each event
+    for day in free_times:
+        if len(day) > 2:
+            start_interval = day[0]
+            end_interval = day[-1]
+
+            start_interval[1] = start_interval[1] - timedelta(minutes=commute_time)
+            end_interval[0] = end_interval[0] + timedelta(minutes=commute_time)
+
+    return free_times
+
+# Minutes of a duration like "30 min", "1 hour", "1.5 hours" or "2h 30m", None if it has none
+def parse_minutes(duration: str) -> int | None:
+    hours = re.search(r"(\d+(?:\.\d+)?)\s*h", duration, re.IGNORECASE)
+    minutes = re.search(r"(\d+)\s*m", duration, re.IGNORECASE)
+    if not hours and not minutes:
+        return None
+    return int(float(hours.group(1)) * 60 if hours else 0) + int(minutes.group(1) if minutes else 0)
+
+# Free minutes, fragmentation and planned fill rate of one candidate setting
+# candidate is (work_hours, travel_time, commute_time), task_minutes are in priority order
+def evaluate(candidate: tuple, days: int, busy: list[tuple[datetime, datetime]], now: datetime, start_of_day: bool, task_minutes: list[int]) -> dict:
+    work_hours, travel_time, commute_time = candidate
+    week = free_times(busy, work_hours, travel_time, commute_time, now, start_of_day)
+
+    intervals = []
+    for day in range(days):
+        for start, end in week[(day + now.weekday()) % len(week)]:
+            minutes = int((end - start).total_seconds() // 60)
+            if minutes > 0:
+                intervals.append(minutes)
+
+    free_minutes = sum(intervals)
+
+    # 0 when all the free time is one block, close to 1 when it is split into many small ones
+    fragmentation = 1 - max(intervals) / free_minutes if free_minutes else 0.0
+
+    # Tasks are placed in priority order into the earliest free time, split into blocks of at least 15 minutes
+    remaining = [minutes for minutes in intervals if minutes >= MIN_BLOCK_MINUTES]
+    planned = 0
+    for needed in task_minutes:
+        for i in range(len(remaining)):
+            if needed <= 0:
+                break
+            if remaining[i] < MIN_BLOCK_MINUTES:
+                continue
+
+            placed = min(needed, remaining[i])
+            if placed < MIN_BLOCK_MINUTES and placed < needed:
+                continue
+            remaining[i] -= placed
+            needed -= placed
+            planned += placed
+
+    required = sum(task_minutes)
+    return {
+        "travel_time": travel_time,
+        "commute_time": commute_time,
+        "free_minutes": free_minutes,
+        "blocks": len(intervals),
+        "fragmentation": fragmentation,
+        "fill_rate": planned / required if required else 1.0,
+    }
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+import config
+import rateLimiter
+
+# Only the fields the app reads, everything else stays on Google's side
+CALENDAR_LIST_FIELDS = "etag,nextPageToken,items(id,summary)"
+EVENT_FIELDS = "nextPageToken,items(id,summary,start,end,transparency)"
+
+# Largest pages the Calendar API allows, so a run needs as few round trips as possible
+CALENDAR_LIST_PAGE_SIZE = 250
+EVENT_PAGE_SIZE = 2500
+
+# Payload size and parse time of the Google reads of the current run
+stats = {"requests": 0, "bytes": 0, "parse_seconds": 0.0}
+stats_lock = threading.Lock()
+
+def reset_stats():
+    with stats_lock:
+        stats.update({"requests": 0, "bytes": 0, "parse_seconds": 0.0})
+
+def report_stats():
+    with stats_lock:
+        print(
+            f"Google reads: {stats['requests']} requests, {stats['bytes'] / 1024:.1f} KiB of JSON, "
+            f"{stats['parse_seconds'] * 1000:.1f} ms parsing"
+        )
+
+# Execute a read with gzip enabled, recording the size of the payload and how long it took to parse
+def fetch(request):
+    # Google only compresses responses for clients whose user agent mentions gzip
+    if "gzip" not in request.headers.get("user-agent", ""):
+        request.headers["user-agent"] = f"{request.headers.get('user-agent', '')} (gzip)".strip()
+    request.headers["accept-encoding"] = "gzip"
+
+    postproc = request.postproc
+
+    def measured(resp, content):
+        started = time.perf_counter()
+        result = postproc(resp, content)
+        elapsed = time.perf_counter() - started
+
+        with stats_lock:
+            stats["requests"] += 1
+            stats["bytes"] += len(content or b"")
+            stats["parse_seconds"] += elapsed
+        return result
+
+    request.postproc = measured
+    return rateLimiter.call("google", request.execute)
+
+# Run fn over the items on a thread pool, the Google limiter still bounds how many requests are in flight
+# Results come back in the order of the items
+def map_concurrently(fn, items: list) -> list:
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(len(items), config.rate_limits["google"][2])) as executor:
+        return list(executor.map(fn, items))
+
+# Follow nextPageToken until every page has been read, make_request takes the page token
+def fetch_all(make_request) -> list[dict]:
+    items = []
+    page_token = None
+
+    while True:
+        response = fetch(make_request(page_token))
+        items += response.get("items", [])
+
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return items
+
+# The calendar list rarely changes, so it is cached per account and only revalidated with its ETag
+def list_calendars(service, account: str = config.DEFAULT_ACCOUNT) -> list[dict]:
+    cache_key = calendar_list_cache_key(account)
+    cached = json.loads(config.settings.value(cache_key, "{}", type=str) or "{}")
+
+    # A 304 only helps while the items its ETag belongs to are still cached
+    if not isinstance(cached.get("items"), list):
+        cached = {}
+
+    try:
+        items, etag = read_calendar_list(service, cached.get("etag"))
+    except HttpError as error:
+        if error.resp.status != 304:
+            raise
+        if cached:
+            return cached["items"]
+
+        # Nothing to fall back on, read the whole list again
+        items, etag = read_calendar_list(service, None)
+
+    config.settings.setValue(cache_key, json.dumps({"etag": etag, "items": items}))
+    return items
+
+def calendar_list_cache_key(account: str) -> str:
+    return config.CALENDAR_LIST_CACHE if account == config.DEFAULT_ACCOUNT else f"{config.CALENDAR_LIST_CACHE}/{account}"
+
+# Every page of the calendar list and the ETag of the whole list, raises HttpError 304 if etag is still current
+def read_calendar_list(service, etag: str | None) -> tuple[list[dict], str | None]:
+    items = []
+    page_token = None
+
+    while True:
+        request = service.calendarList().list(fields=CALENDAR_LIST_FIELDS, maxResults=CALENDAR_LIST_PAGE_SIZE, pageToken=page_token)
+
+        # The first page carries the ETag of the whole list
+        if page_token is None and etag:
+            request.headers["If-None-Match"] = etag
+
+        response = fetch(request)
+
+        if page_token is None:
+            list_etag = response.get("etag")
+        items += response.get("items", [])
+
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return items, list_etag
+
+def list_events(service, calendar_id: str, time_min: str, time_max: str) -> list[dict]:
+    return fetch_all(lambda token: service.events().list(
+        calendarId=calendar_id,
+        timeMin=time_min,
+        timeMax=time_max,
+        singleEvents=True,
+        orderBy="startTime",
+        fields=EVENT_FIELDS,
+        maxResults=EVENT_PAGE_SIZE,
+        pageToken=token,
+    ))
+
+# Whether any event of the calendar was added, changed or deleted after updated_min
+def changed_since(service, calendar_id: str, updated_min: str) -> bool:
+    response = fetch(service.events().list(
+        calendarId=calendar_id,
+        updatedMin=updated_min,
+        showDeleted=True,
+        maxResults=1,
+        fields="items(id)",
+    ))
+    return bool(response.get("items"))
@@ -0,0 +1,179 @@
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cassette
+import config
+import ledger
+
+# Blocks published in the feed are kept in the ledger under this calendar instead of a Google calendar
+CALENDAR_ID = "ics"
+
+PATH = "/ai-tasks.ics"
+
+# Blocks that ended longer ago than this drop out of the feed
+HISTORY = timedelta(days=14)
+
+HEADER = [
+    "BEGIN:VCALENDAR",
+    "VERSION:2.0",
+    "PRODID:-//AICalendar//AI Tasks//EN",
+    "CALSCALE:GREGORIAN",
+    "METHOD:PUBLISH",
+    "X-WR-CALNAME:AI Tasks",
+]
+FOOTER = ["END:VCALENDAR"]
+
+# Rendered VEVENT of each block by event ID, with the block values it was rendered from,
+# so a publish only renders the blocks that were added or changed
+vevents = {}
+
+# The served feed, only replaced when a publish changed it
+feed = {"body": b"", "etag": None, "modified": None}
+lock = threading.Lock()
+
+server = None
+server_thread = None
+
+def url() -> str:
+    return f"http://127.0.0.1:{config.ics_port}{PATH}"
+
+def escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def utc(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+# Lines longer than 75 octets continue on the next line after a space
+def fold(line: str) -> str:
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+
+    parts = []
+    while encoded:
+        size = 75 if not parts else 74
+        # Never cut a multi byte character in half
+        while size < len(encoded) and (encoded[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(encoded[:size].decode("utf-8"))
+        encoded = encoded[size:]
+    return "\r\n ".join(parts)
+
+def render(block: ledger.Block, stamp: datetime) -> str:
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{block.event_id}@aicalendar",
+        f"DTSTAMP:{utc(stamp)}",
+        f"DTSTART:{utc(block.start)}",
+        f"DTEND:{utc(block.end)}",
+        f"SUMMARY:{escape(block.title)}",
+        f"SEQUENCE:{block.plan_version}",
+        "TRANSP:OPAQUE",
+        "END:VEVENT",
+    ]
+    return "\r\n".join(fold(line) for line in lines)
+
+# Bring the feed up to date with the ledger, returns whether it changed
+def publish() -> bool:
+    now = cassette.now().astimezone()
+    blocks = ledger.blocks_in_calendar(CALENDAR_ID, now - HISTORY)
+
+    with lock:
+        changed = False
+        current = {}
+        for block in blocks:
+            values = (block.title, block.start, block.end, block.plan_version)
+            cached = vevents.get(block.event_id)
+
+            if cached is None or cached[0] != values:
+                cached = (values, render(block, now))
+                changed = True
+            current[block.event_id] = cached
+
+        if not changed and current.keys() == vevents.keys() and feed["etag"] is not None:
+            return False
+
+        vevents.clear()
+        vevents.update(current)
+
+        # Blocks come from the ledger sorted by start time
+        body = "\r\n".join(HEADER + [vevents[block.event_id][1] for block in blocks] + FOOTER) + "\r\n"
+        feed["body"] = body.encode("utf-8")
+        feed["etag"] = f'"{hashlib.sha1(feed["body"]).hexdigest()}"'
+        feed["modified"] = datetime.now(timezone.utc)
+        return True
+
+class FeedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.respond(include_body=True)
+
+    def do_HEAD(self):
+        self.respond(include_body=False)
+
+    def respond(self, include_body: bool):
+        if self.path.split("?")[0] != PATH:
+            self.send_error(404)
+            return
+
+        with lock:
+            body, etag, modified = feed["body"], feed["etag"], feed["modified"]
+
+        if etag is None:
+            self.send_error(503, "The feed has not been published yet")
+            return
+
+        # Clients that already have this version only get the headers back
+        known = [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]
+        if etag in known or "*" in known:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/calendar; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", format_datetime(modified, usegmt=True))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        if include_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if config.debug:
+            super().log_message(format, *args)
+
+# Serve the feed on localhost, does nothing if it is already being served
+# Returns an error message if the port can not be used, None once the feed is served
+def start() -> str | None:
+    global server, server_thread
+
+    if server is not None:
+        return None
+
+    publish()
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", config.ics_port), FeedHandler)
+    except OSError as error:
+        return f"The ICS feed could not be served on port {config.ics_port}: {error.strerror or error}"
+    server.daemon_threads = True
+    server_thread = threading.Thread(target=server.serve_forever, name="ics-feed", daemon=True)
+    server_thread.start()
+    return None
+
+def stop():
+    global server, server_thread
+
+    if server is None:
+        return
+
+    server.shutdown()
+    server.server_close()
+    server = None
+    server_thread = None
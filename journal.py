@@ -0,0 +1,254 @@
+import json
+import threading
+
+import httplib2
+from google.auth.exceptions import GoogleAuthError
+from googleapiclient.errors import HttpError
+
+import config
+import ledger
+import rateLimiter
+
+# Calendar mutations waiting to be sent to Google, kept next to the ledger so they
+# survive a crash or a run without network and are resumed by the next flush
+# sending is NEW (never sent), SENDING (taken by a flush) or RETRY (sent before, it may
+# have reached Google), only NEW operations are cancelled or have patches folded in
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    body TEXT,
+    sending INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS journal_event ON journal (event_id);
+"""
+
+NEW = 0
+SENDING = 1
+RETRY = 2
+
+initialized = False
+
+def connect():
+    global initialized
+
+    db = ledger.connect()
+    if not initialized:
+        db.executescript(SCHEMA)
+
+        # Journals written before operations were marked while being sent
+        if "sending" not in [column[1] for column in db.execute("PRAGMA table_info(journal)")]:
+            db.execute("ALTER TABLE journal ADD COLUMN sending INTEGER NOT NULL DEFAULT 0")
+
+        # Whatever was being sent when the app stopped is sent again, every operation is safe to repeat
+        db.execute("UPDATE journal SET sending = ? WHERE sending = ?", (RETRY, SENDING))
+        db.commit()
+        initialized = True
+    return db
+
+def enqueue_insert(calendar_id: str, event_id: str, body: dict):
+    with ledger.lock, connect() as db:
+        db.execute(
+            "INSERT INTO journal (op, calendar_id, event_id, body) VALUES ('insert', ?, ?, ?)",
+            (calendar_id, event_id, json.dumps({**body, "id": event_id})),
+        )
+
+# A patch of an event that is still waiting to be inserted is folded into the insert
+# Operations that a flush is already sending are never changed, the patch is sent after them
+def enqueue_patch(calendar_id: str, event_id: str, body: dict):
+    with ledger.lock, connect() as db:
+        pending = db.execute("SELECT seq, op, body, sending FROM journal WHERE event_id = ? ORDER BY seq", (event_id,)).fetchall()
+
+        if any(op == "delete" for _, op, _, _ in pending):
+            return
+
+        # Only the last operation can take the patch, folding into an earlier one would let a later patch undo it
+        if pending and pending[-1][3] == NEW:
+            seq, _, pending_body, _ = pending[-1]
+            db.execute("UPDATE journal SET body = ? WHERE seq = ?", (json.dumps({**json.loads(pending_body), **body}), seq))
+            return
+
+        db.execute(
+            "INSERT INTO journal (op, calendar_id, event_id, body) VALUES ('patch', ?, ?, ?)",
+            (calendar_id, event_id, json.dumps(body)),
+        )
+
+# An insert that was never sent and is deleted again cancels out, so neither is sent,
+# and patches of an event that is deleted are pointless. Once a flush is sending the
+# insert it may already exist on Google, so a real delete is needed
+def enqueue_delete(calendar_id: str, event_id: str):
+    with ledger.lock, connect() as db:
+        pending = db.execute("SELECT op, sending FROM journal WHERE event_id = ?", (event_id,)).fetchall()
+
+        if any(op == "delete" for op, _ in pending):
+            return
+
+        db.execute("DELETE FROM journal WHERE event_id = ? AND sending = ?", (event_id, NEW))
+        if any(op == "insert" for op, _ in pending) and all(sending == NEW for _, sending in pending):
+            return
+
+        db.execute(
+            "INSERT INTO journal (op, calendar_id, event_id, body) VALUES ('delete', ?, ?, NULL)",
+            (calendar_id, event_id),
+        )
+
+# Take up to limit operations to send and mark them as being sent
+# Google runs the requests of a batch in any order, so a batch holds at most one operation per event
+def pending(limit: int) -> list[dict]:
+    with ledger.lock, connect() as db:
+        busy = {row[0] for row in db.execute("SELECT event_id FROM journal WHERE sending = ?", (SENDING,))}
+
+        rows = []
+        for row in db.execute("SELECT seq, op, calendar_id, event_id, body FROM journal WHERE sending != ? ORDER BY seq", (SENDING,)).fetchall():
+            if len(rows) >= limit:
+                break
+            if row[3] in busy:
+                continue
+            busy.add(row[3])
+            rows.append(row)
+
+        db.executemany("UPDATE journal SET sending = ? WHERE seq = ?", [(SENDING, row[0]) for row in rows])
+
+    return [
+        {"seq": seq, "op": op, "calendar_id": calendar_id, "event_id": event_id, "body": json.loads(body) if body else None}
+        for seq, op, calendar_id, event_id, body in rows
+    ]
+
+# Operations whose flush failed wait for the next one, they may have reached Google already
+def release(seqs: list[int]):
+    with ledger.lock, connect() as db:
+        db.executemany("UPDATE journal SET sending = ? WHERE seq = ?", [(RETRY, seq) for seq in seqs])
+
+def pending_count() -> int:
+    with ledger.lock:
+        return connect().execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+def remove(seqs: list[int]):
+    with ledger.lock, connect() as db:
+        db.executemany("DELETE FROM journal WHERE seq = ?", [(seq,) for seq in seqs])
+
+# Send a group of operations as one Google batch request, returns the status and link of each by seq
+def execute_batch(ops: list[dict]) -> dict[str, dict]:
+    from googleapiclient.discovery import build
+
+    import AI
+
+    service = build("calendar", "v3", credentials=AI.google_auth())
+    results = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            status = exception.resp.status if isinstance(exception, HttpError) else 500
+            if rateLimiter.is_retryable(exception, status):
+                status = 429
+            results[request_id] = {"status": status, "link": None}
+        else:
+            results[request_id] = {"status": None, "link": (response or {}).get("htmlLink")}
+
+    batch = service.new_batch_http_request(callback=callback)
+    for op in ops:
+        if op["op"] == "insert":
+            request = service.events().insert(calendarId=op["calendar_id"], body=op["body"])
+        elif op["op"] == "patch":
+            request = service.events().patch(calendarId=op["calendar_id"], eventId=op["event_id"], body=op["body"])
+        else:
+            request = service.events().delete(calendarId=op["calendar_id"], eventId=op["event_id"])
+        batch.add(request, request_id=str(op["seq"]))
+
+    batch.execute()
+    return results
+
+flush_lock = threading.Lock()
+links = {}
+
+# Send everything in the journal, returns False if something has to be retried later
+def flush() -> bool:
+    with flush_lock:
+        while True:
+            ops = pending(config.journal_batch_size)
+            if not ops:
+                return True
+
+            try:
+                results = rateLimiter.call("google", execute_batch, ops)
+            except (HttpError, httplib2.HttpLib2Error, OSError, GoogleAuthError) as error:
+                # Refreshing an expired token offline fails with a GoogleAuthError
+                release([op["seq"] for op in ops])
+                print(f"Calendar sync postponed: {error}")
+                return False
+            except BaseException:
+                release([op["seq"] for op in ops])
+                raise
+
+            done = []
+            retry = []
+            for op in ops:
+                status = results.get(str(op["seq"]), {"status": 500})["status"]
+
+                # 409 means an earlier flush already inserted the event, 404/410 that it is already gone
+                if status is None or (op["op"] == "insert" and status == 409) or (op["op"] != "insert" and status in (404, 410)):
+                    done.append(op["seq"])
+                    if op["op"] == "insert":
+                        links[op["event_id"]] = results.get(str(op["seq"]), {}).get("link")
+                elif status in rateLimiter.RETRYABLE_STATUSES:
+                    retry.append(op["seq"])
+                else:
+                    print(f"Dropping calendar {op['op']} of {op['event_id']}, failed with status {status}")
+                    done.append(op["seq"])
+
+            remove(done)
+            if retry:
+                release(retry)
+                return False
+
+wake = threading.Event()
+callbacks = []
+callbacks_lock = threading.Lock()
+flusher = None
+
+# Flush and, once the journal is empty, hand the links of the inserted events to the waiting callbacks
+def drain() -> bool:
+    if not flush():
+        return False
+
+    with callbacks_lock:
+        ready = callbacks[:]
+        callbacks.clear()
+        flushed = dict(links)
+        links.clear()
+
+    for callback in ready:
+        try:
+            callback(flushed)
+        except Exception as error:
+            print(f"Calendar sync callback failed: {error}")
+    return True
+
+# Background flusher, retries on an interval while offline or throttled
+def run_flusher():
+    while True:
+        wake.wait(config.journal_retry_interval)
+        wake.clear()
+
+        # The flusher must outlive any failure, the journal is retried on the next round
+        try:
+            drain()
+        except Exception as error:
+            print(f"Calendar sync failed: {error}")
+
+def start():
+    global flusher
+
+    if flusher is None or not flusher.is_alive():
+        flusher = threading.Thread(target=run_flusher, name="calendar-journal", daemon=True)
+        flusher.start()
+
+# Wake the flusher, callback gets {event ID: link} of the inserted events once the journal is empty
+def flush_async(callback=None):
+    if callback is not None:
+        with callbacks_lock:
+            callbacks.append(callback)
+    start()
+    wake.set()
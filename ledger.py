@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import config
+
+# Every AI block that was put on the calendar, indexed by task and by time so that
+# regenerating a window only has to look at the blocks that overlap it
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    event_id TEXT PRIMARY KEY,
+    calendar_id TEXT NOT NULL,
+    task_id TEXT,
+    title TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    plan_version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blocks_task ON blocks (task_id);
+CREATE INDEX IF NOT EXISTS blocks_time ON blocks (start_time, end_time);
+"""
+
+# Blocks are planned inside one day's work hours, so none is longer than this. Bounding the
+# start time from both sides keeps window lookups to the blocks around the window
+MAX_BLOCK_LENGTH = timedelta(days=1)
+
+class Block:
+    def __init__(self, event_id: str, calendar_id: str, task_id: str | None, title: str, start: datetime, end: datetime, plan_version: int):
+        self.event_id = event_id
+        self.calendar_id = calendar_id
+        self.task_id = task_id
+        self.title = title
+        self.start = start
+        self.end = end
+        self.plan_version = plan_version
+
+    @classmethod
+    def from_row(cls, row) -> "Block":
+        event_id, calendar_id, task_id, title, start, end, plan_version = row
+        return cls(event_id, calendar_id, task_id, title, datetime.fromtimestamp(start).astimezone(), datetime.fromtimestamp(end).astimezone(), plan_version)
+
+lock = threading.Lock()
+connection = None
+
+def connect() -> sqlite3.Connection:
+    global connection
+
+    if connection is None:
+        connection = sqlite3.connect(os.path.join(config.data_dir, "ledger.sqlite3"), check_same_thread=False)
+        connection.executescript(SCHEMA)
+    return connection
+
+# Naive datetimes are treated as local time, like the rest of the app
+def timestamp(value: datetime) -> int:
+    return int(value.astimezone().timestamp())
+
+def next_plan_version() -> int:
+    with lock:
+        row = connect().execute("SELECT MAX(plan_version) FROM blocks").fetchone()
+    return (row[0] or 0) + 1
+
+def add_block(event_id: str, calendar_id: str, task_id: str | None, title: str, start: datetime, end: datetime, plan_version: int):
+    with lock, connect() as db:
+        db.execute(
+            "INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (event_id, calendar_id, task_id, title, timestamp(start), timestamp(end), plan_version),
+        )
+
+def move_block(event_id: str, start: datetime, end: datetime):
+    with lock, connect() as db:
+        db.execute("UPDATE blocks SET start_time = ?, end_time = ? WHERE event_id = ?", (timestamp(start), timestamp(end), event_id))
+
+def remove_blocks(event_ids: list[str]):
+    with lock, connect() as db:
+        db.executemany("DELETE FROM blocks WHERE event_id = ?", [(event_id,) for event_id in event_ids])
+
+# Blocks that overlap [start, end)
+def blocks_in_window(start: datetime, end: datetime) -> list[Block]:
+    with lock:
+        rows = connect().execute(
+            "SELECT * FROM blocks WHERE start_time < ? AND start_time > ? AND end_time > ? ORDER BY start_time",
+            (timestamp(end), timestamp(start - MAX_BLOCK_LENGTH), timestamp(start)),
+        ).fetchall()
+    return [Block.from_row(row) for row in rows]
+
+def blocks_in_calendar(calendar_id: str, since: datetime) -> list[Block]:
+    with lock:
+        rows = connect().execute(
+            "SELECT * FROM blocks WHERE calendar_id = ? AND end_time > ? ORDER BY start_time",
+            (calendar_id, timestamp(since)),
+        ).fetchall()
+    return [Block.from_row(row) for row in rows]
+
+# Forget blocks that ended before the given time, nothing looks that far back
+def prune(before: datetime):
+    with lock, connect() as db:
+        db.execute("DELETE FROM blocks WHERE start_time < ? AND end_time < ?", (timestamp(before - MAX_BLOCK_LENGTH), timestamp(before)))
+
+def blocks_for_task(task_id: str) -> list[Block]:
+    with lock:
+        rows = connect().execute("SELECT * FROM blocks WHERE task_id = ? ORDER BY start_time", (task_id,)).fetchall()
+    return [Block.from_row(row) for row in rows]
+
+def get_block(event_id: str) -> Block | None:
+    with lock:
+        row = connect().execute("SELECT * FROM blocks WHERE event_id = ?", (event_id,)).fetchone()
+    return Block.from_row(row) if row else None
@@ -0,0 +1,156 @@
+import ctypes
+import gc
+import os
+import sys
+import tracemalloc
+import types
+
+import config
+import ledger
+import whatIf
+
+# Top level packages reported as one component each, everything else counts as "other"
+COMPONENTS = {
+    "google.genai": "gemini",
+    "openai": "openai",
+    "notion_client": "notion",
+    "googleapiclient": "google",
+    "google": "google",
+    "httplib2": "google",
+    "httpx": "http",
+    "httpcore": "http",
+    "pydantic": "pydantic",
+    "pydantic_core": "pydantic",
+    "PySide6": "qt",
+    "shiboken6": "qt",
+}
+
+# Modules that are only needed while planning and are imported again on next use
+UNLOADABLE = ("google.genai", "openai")
+
+# Resident set size of this process in bytes, None if the platform is not supported
+def rss_bytes() -> int | None:
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    if sys.platform == "win32":
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+
+    # macOS only exposes the peak through the standard library
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def component_of(module_name: str) -> str:
+    for prefix, component in COMPONENTS.items():
+        if module_name == prefix or module_name.startswith(prefix + "."):
+            return component
+    return "other"
+
+def component_of_file(filename: str) -> str:
+    filename = filename.replace(os.sep, "/")
+    for prefix, component in COMPONENTS.items():
+        if f"/{prefix.replace('.', '/')}/" in filename:
+            return component
+    return "other"
+
+# Functions, classes and code belong to the module that defined them, other objects to their type's module
+# Only the exact type is looked at, isinstance() would wake up lazy proxies such as the ones openai uses
+def component_of_object(obj) -> str:
+    kind = type(obj)
+    if kind is types.FunctionType or issubclass(kind, type):
+        return component_of(obj.__module__ or "")
+    if kind is types.ModuleType:
+        return component_of(obj.__name__)
+    if kind is types.CodeType:
+        return component_of_file(obj.co_filename)
+    return component_of(kind.__module__ or "")
+
+# Bytes retained per component, from tracemalloc when tracing, otherwise estimated from live objects
+def retainers() -> dict[str, int]:
+    sizes = {}
+
+    if tracemalloc.is_tracing():
+        for stat in tracemalloc.take_snapshot().statistics("filename"):
+            component = component_of_file(stat.traceback[0].filename)
+            sizes[component] = sizes.get(component, 0) + stat.size
+    else:
+        for obj in gc.get_objects():
+            component = component_of_object(obj)
+            sizes[component] = sizes.get(component, 0) + sys.getsizeof(obj, 0)
+
+    return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+def loaded_modules() -> dict[str, int]:
+    counts = {}
+    for name in list(sys.modules):
+        component = component_of(name)
+        counts[component] = counts.get(component, 0) + 1
+    return counts
+
+def report() -> str:
+    rss = rss_bytes()
+    lines = [f"RSS: {rss / 2**20:.1f} MiB" if rss is not None else "RSS: unavailable"]
+
+    modules = loaded_modules()
+    for component, size in retainers().items():
+        lines.append(f"  {component:<10} {size / 2**20:8.2f} MiB  {modules.get(component, 0)} modules")
+    return "\n".join(lines)
+
+# Drop clients, caches and the modules only used while planning, then hand freed memory back to the OS
+def trim():
+    config.gemini_client = None
+    config.notion_client = None
+
+    # The simulation workers are separate processes, they are started again when needed
+    whatIf.shutdown()
+
+    # SQLite keeps a page cache per connection, the ledger reconnects on next use
+    with ledger.lock:
+        if ledger.connection is not None:
+            ledger.connection.close()
+            ledger.connection = None
+
+    for name in list(sys.modules):
+        if any(name == prefix or name.startswith(prefix + ".") for prefix in UNLOADABLE):
+            module = sys.modules.pop(name)
+
+            # The parent package holds on to its submodules as attributes
+            parent, _, child = name.rpartition(".")
+            if parent in sys.modules and getattr(sys.modules[parent], child, None) is module:
+                delattr(sys.modules[parent], child)
+
+    gc.collect()
+
+    # glibc keeps freed memory in its arenas until asked to release it
+    if sys.platform.startswith("linux"):
+        try:
+            ctypes.CDLL("libc.so.6").malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+# Tracing allocations costs time and memory, so it is only done when asked for
+if config.trace_memory:
+    tracemalloc.start()
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from notion_client import errors
+
+import config
+import rateLimiter
+
+# Write the planned start, end and calendar link of every scheduled task back to its Notion page
+# placements maps a page ID to (start, end, link), tasks carry the values Notion already has
+def write_back(tasks: list, placements: dict[str, tuple[datetime, datetime, str]]):
+    if config.get_notion_client() == None or not placements:
+        return
+
+    current = {task.id: task for task in tasks or []}
+
+    updates = []
+    for page_id, (start, end, link) in placements.items():
+        task = current.get(page_id)
+        if task is not None and is_current(task, start, end, link):
+            continue
+        updates.append((page_id, start, end, link))
+
+    if config.debug:
+        print(f"Writing back {len(updates)} of {len(placements)} scheduled tasks to Notion")
+
+    # The limiter keeps the workers within Notion's request rate
+    with ThreadPoolExecutor(max_workers=config.writeback_workers) as pool:
+        for _ in pool.map(lambda update: update_page(*update), updates):
+            pass
+
+def is_current(task, start: datetime, end: datetime, link: str) -> bool:
+    return (
+        task.scheduled_start == start.astimezone()
+        and task.scheduled_end == end.astimezone()
+        and (link is None or task.event_link == link)
+    )
+
+def update_page(page_id: str, start: datetime, end: datetime, link: str):
+    properties = {
+        config.scheduled_property: {"date": {"start": start.astimezone().isoformat(), "end": end.astimezone().isoformat()}},
+    }
+    if link is not None:
+        properties[config.event_link_property] = {"url": link}
+
+    try:
+        rateLimiter.call("notion", config.get_notion_client().pages.update, page_id=page_id, properties=properties)
+    except errors.HTTPResponseError as error:
+        print(f"Notion error occurred while writing back {page_id}: {error}")
@@ -0,0 +1,86 @@
+import threading
+
+from PySide6 import QtCore
+
+import AI
+import config
+import taskSources
+
+# Prepares the next plan of each regenerate action while the tray is idle, so that a
+# click only has to check that nothing changed before applying it
+class PrePlanner(QtCore.QObject):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.plans = {}
+        self.lock = threading.Lock()
+        self.worker = None
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.prepare)
+        self.timer.start(config.preplan_interval * 1000)
+
+    # Start preparing in the background unless a previous round is still running
+    @QtCore.Slot()
+    def prepare(self):
+        if self.busy():
+            return
+        if not taskSources.available() or not AI.google_authorized():
+            return
+
+        self.worker = threading.Thread(target=self.prepare_all, name="pre-planner", daemon=True)
+        self.worker.start()
+
+    def prepare_all(self):
+        # A missing or revoked token fails the round instead of opening the sign in flow on this thread
+        AI.background.interactive = False
+
+        for days in config.preplan_horizons:
+            try:
+                with self.lock:
+                    plan = self.plans.get(days)
+
+                # Only ask the model again when the inputs changed
+                if plan is not None and AI.plan_is_current(plan):
+                    continue
+
+                plan = AI.plan_tasks(days, fingerprint=True)
+                with self.lock:
+                    self.plans[days] = plan
+            except Exception as error:
+                print(f"Pre-planning {days} days failed: {error}")
+
+    # The prepared plan for the days if it still matches its inputs, otherwise None
+    def take(self, days: int) -> AI.Plan | None:
+        with self.lock:
+            plan = self.plans.pop(days, None)
+
+        if plan is None:
+            return None
+
+        try:
+            if AI.plan_is_current(plan):
+                return plan
+        except Exception as error:
+            print(f"Checking the prepared plan failed: {error}")
+        return None
+
+    def busy(self) -> bool:
+        return self.worker is not None and self.worker.is_alive()
+
+    # Stop preparing while the tray is idle, prepared plans are small and kept
+    def pause(self):
+        self.timer.stop()
+
+    def resume(self):
+        if not self.timer.isActive():
+            self.timer.start(config.preplan_interval * 1000)
+            self.prepare()
+
+    # Applying a plan changes the ledger, so every prepared plan is stale afterwards
+    def invalidate(self):
+        with self.lock:
+            self.plans.clear()
+
+        # Prepare again shortly, once the applied plan has settled
+        QtCore.QTimer.singleShot(30 * 1000, self.prepare)
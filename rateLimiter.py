@@ -0,0 +1,189 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import cassette
+import config
+
+# Statuses worth retrying: throttling and transient server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Google reports per-user throttling as a 403 with one of these reasons
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+# Token bucket that refills at a fixed rate and blocks until a token is available
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Per-service limiter: a token bucket plus a concurrency limit that halves when throttled and slowly recovers
+class ServiceLimiter:
+    def __init__(self, rate: float, burst: float, max_concurrency: int):
+        self.base_rate = rate
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+        self.bucket.acquire()
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    # Additive increase after a success
+    def succeeded(self):
+        with self.condition:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+        with self.bucket.lock:
+            self.bucket.rate = min(self.base_rate, self.bucket.rate * 1.05)
+
+    # Multiplicative decrease after being throttled
+    def throttled(self):
+        with self.condition:
+            self.limit = max(1.0, self.limit / 2)
+        with self.bucket.lock:
+            self.bucket.rate = max(self.base_rate / 16, self.bucket.rate / 2)
+            self.bucket.tokens = min(self.bucket.tokens, 0)
+
+limiters = {}
+limiters_lock = threading.Lock()
+
+# Get the shared limiter of a service, creating it from config.rate_limits on first use
+def get_limiter(service: str) -> ServiceLimiter:
+    with limiters_lock:
+        if service not in limiters:
+            rate, burst, max_concurrency = config.rate_limits.get(service, (5, 5, 2))
+            limiters[service] = ServiceLimiter(rate, burst, max_concurrency)
+        return limiters[service]
+
+# Replace the limiter of a service, used when the limits change
+def configure(service: str, rate: float, burst: float, max_concurrency: int):
+    with limiters_lock:
+        limiters[service] = ServiceLimiter(rate, burst, max_concurrency)
+
+# Pull the HTTP status and Retry-After header out of a Google, Notion, Gemini or OpenAI error
+def inspect_error(error: Exception) -> tuple[int | None, float | None]:
+    status = None
+    headers = None
+
+    resp = getattr(error, "resp", None)  # googleapiclient HttpError
+    if resp is not None:
+        status = getattr(resp, "status", None)
+        headers = resp
+    else:
+        for attribute in ("status_code", "code", "status"):
+            value = getattr(error, attribute, None)
+            if isinstance(value, int):
+                status = value
+                break
+
+        headers = getattr(error, "headers", None)
+        if headers is None:
+            headers = getattr(getattr(error, "response", None), "headers", None)
+
+    retry_after = None
+    if headers is not None:
+        retry_after = parse_retry_after(headers.get("retry-after") or headers.get("Retry-After"))
+
+    return status, retry_after
+
+# Retry-After is either a number of seconds or an HTTP date
+def parse_retry_after(value) -> float | None:
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+# Server errors are only retried for requests that are safe to send twice, a failed
+# request may still have been carried out
+def is_retryable(error: Exception, status: int | None, idempotent: bool = True) -> bool:
+    if status == 429:
+        return True
+    if status in RETRYABLE_STATUSES:
+        return idempotent
+    if status == 403:
+        content = getattr(error, "content", b"") or b""
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", "replace")
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+# Full jitter exponential backoff, never shorter than what the server asked for
+def backoff(attempt: int, retry_after: float | None) -> float:
+    delay = random.uniform(0, min(config.backoff_cap, config.backoff_base * 2 ** attempt))
+    if retry_after is not None:
+        delay = retry_after + random.uniform(0, config.backoff_base)
+    return delay
+
+# Call fn through the limiter of the service, retrying throttled and transient failures
+# Pass idempotent=False for requests that must not be repeated after a server error, such as creating a resource
+def call(service: str, fn, *args, idempotent: bool = True, **kwargs):
+    if cassette.mode is not None:
+        return cassette.call(service, fn, args, kwargs, lambda: call_with_retry(service, fn, *args, idempotent=idempotent, **kwargs))
+    return call_with_retry(service, fn, *args, idempotent=idempotent, **kwargs)
+
+def call_with_retry(service: str, fn, *args, idempotent: bool = True, **kwargs):
+    limiter = get_limiter(service)
+
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as error:
+            limiter.release()
+
+            status, retry_after = inspect_error(error)
+            if not is_retryable(error, status, idempotent) or attempt >= config.max_retries:
+                raise
+
+            limiter.throttled()
+            delay = backoff(attempt, retry_after)
+            if config.debug:
+                print(f"{service} request failed with status {status}, retrying in {delay:.2f}s")
+
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        limiter.release()
+        limiter.succeeded()
+        return result
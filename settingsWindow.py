@@ -1,11 +1,17 @@
 import copy
+import json
+import os
 import re
+import threading
 from datetime import datetime, time
 
 from PySide6 import QtCore, QtWidgets
 
+import AI
 import config
+import icsFeed
 import utils
+import whatIf
 
 # Overwrites the default text formatting so that the text is not formatted when pasted
 class PlainTextEdit(QtWidgets.QTextEdit):
@@ -20,6 +26,9 @@ class PlainTextEdit(QtWidgets.QTextEdit):
 
 # Settings window class
 class SettingsWindow(QtWidgets.QWidget):
+    # Results of a what-if simulation, sent from the simulation thread
+    preview_ready = QtCore.Signal(object)
+
     def __init__(self, main_widget):
         super().__init__()
 
@@ -79,17 +88,61 @@ class SettingsWindow(QtWidgets.QWidget):
             lower_bound_input.setText(self.times[i][0])
             lower_bound_input.setCompleter(self.completer)
             lower_bound_input.editingFinished.connect(lambda i=i: self.format_time(i, "lower"))
+            lower_bound_input.editingFinished.connect(self.schedule_preview)
 
             upper_bound_input = QtWidgets.QLineEdit()
             upper_bound_input.setText(self.times[i][1])
             upper_bound_input.setCompleter(self.completer)
             upper_bound_input.editingFinished.connect(lambda i=i: self.format_time(i, "upper"))
+            upper_bound_input.editingFinished.connect(self.schedule_preview)
 
             self.grid_time_layout.addWidget(label, i + 1, 0)
             self.grid_time_layout.addWidget(lower_bound_input, i + 1, 1)
             self.grid_time_layout.addWidget(upper_bound_input, i + 1, 2)
 
         layout.addLayout(self.grid_time_layout)
+
+        buffer_layout = QtWidgets.QHBoxLayout()
+
+        buffer_layout.addWidget(QtWidgets.QLabel("Travel Time (min):"))
+        self.travel_time_input = QtWidgets.QSpinBox()
+        self.travel_time_input.setRange(0, 120)
+        self.travel_time_input.setSingleStep(5)
+        self.travel_time_input.setValue(config.travel_time)
+        self.travel_time_input.valueChanged.connect(self.schedule_preview)
+        buffer_layout.addWidget(self.travel_time_input)
+
+        buffer_layout.addWidget(QtWidgets.QLabel("Commute Time (min):"))
+        self.commute_time_input = QtWidgets.QSpinBox()
+        self.commute_time_input.setRange(0, 180)
+        self.commute_time_input.setSingleStep(5)
+        self.commute_time_input.setValue(config.commute_time)
+        self.commute_time_input.valueChanged.connect(self.schedule_preview)
+        buffer_layout.addWidget(self.commute_time_input)
+
+        layout.addLayout(buffer_layout)
+
+        # What the entered settings and nearby travel and commute times would leave free,
+        # simulated against the busy time and tasks of the last plan
+        self.preview_label = QtWidgets.QLabel()
+        layout.addWidget(self.preview_label)
+
+        self.preview_table = QtWidgets.QTableWidget(0, 6)
+        self.preview_table.setHorizontalHeaderLabels(["Travel", "Commute", "Free Time", "Blocks", "Fragmentation", "Fill Rate"])
+        self.preview_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.preview_table.verticalHeader().setVisible(False)
+        layout.addWidget(self.preview_table)
+
+        self.preview_worker = None
+        self.preview_pending = False
+        self.preview_ready.connect(self.show_preview)
+
+        # Typing in the spin boxes only simulates once the value settles
+        self.preview_timer = QtCore.QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(150)
+        self.preview_timer.timeout.connect(self.preview)
+        self.preview_timer.start()
         
         self.use_gemini = config.use_gemini
         
@@ -153,7 +206,43 @@ class SettingsWindow(QtWidgets.QWidget):
         
         if self.google_auth_file:
             self.google_auth_label.setText(f"Google Auth File: {self.google_auth_file}")
+
+        # Calendars of extra accounts only count as busy time, AI Tasks stay in the default account
+        self.accounts_label = QtWidgets.QLabel(f"Google Accounts: {', '.join(config.google_accounts)}")
+        layout.addWidget(self.accounts_label)
+
+        self.add_account_button = QtWidgets.QPushButton("Add Google Account")
+        self.add_account_button.clicked.connect(self.add_google_account)
+        layout.addWidget(self.add_account_button)
+
+        # Local to-do files are read next to the Notion database
+        self.task_files_label = QtWidgets.QLabel()
+        self.update_task_files_label()
+        layout.addWidget(self.task_files_label)
+
+        self.add_task_file_button = QtWidgets.QPushButton("Add Task File")
+        self.add_task_file_button.clicked.connect(self.add_task_file)
+        layout.addWidget(self.add_task_file_button)
     
+        # Calendar apps can subscribe to the plan instead of it being written to Google Calendar
+        self.ics_checkbox = QtWidgets.QCheckBox("Publish the plan as a local ICS feed instead of writing to Google Calendar")
+        self.ics_checkbox.setChecked(config.output_mode == "ics")
+        layout.addWidget(self.ics_checkbox)
+
+        ics_layout = QtWidgets.QHBoxLayout()
+
+        ics_layout.addWidget(QtWidgets.QLabel("Feed Port:"))
+        self.ics_port_input = QtWidgets.QSpinBox()
+        self.ics_port_input.setRange(1024, 65535)
+        self.ics_port_input.setValue(config.ics_port)
+        ics_layout.addWidget(self.ics_port_input)
+
+        self.ics_label = QtWidgets.QLabel(f"Feed URL: {icsFeed.url()}")
+        self.ics_label.setTextInteractionFlags(QtCore.Qt.TextSelectableByMouse)
+        ics_layout.addWidget(self.ics_label)
+
+        layout.addLayout(ics_layout)
+
         # Save button
         save_button = QtWidgets.QPushButton("Save")
         save_button.clicked.connect(self.apply_settings)
@@ -171,6 +260,124 @@ class SettingsWindow(QtWidgets.QWidget):
             self.google_auth_file = file_path
             self.google_auth_label.setText(f"Google Auth File: {file_path}")
 
+    # Sign in to another Google account, its calendars are read alongside the default account's
+    @QtCore.Slot()
+    def add_google_account(self):
+        name, ok = QtWidgets.QInputDialog.getText(self, "Add Google Account", "Account name:")
+        name = name.strip()
+        if not ok or not name:
+            return
+
+        if name in config.google_accounts:
+            QtWidgets.QMessageBox.warning(self, "Error", f"The account {name} was already added!", QtWidgets.QMessageBox.Ok)
+            return
+
+        if not config.settings.value(config.GOOGLE_AUTH, "", type=str):
+            QtWidgets.QMessageBox.critical(self, "Error", "Select a Google Auth File first!", QtWidgets.QMessageBox.Ok)
+            return
+
+        AI.google_auth(name)
+
+        config.google_accounts = config.google_accounts + [name]
+        config.settings.setValue(config.GOOGLE_ACCOUNTS, config.google_accounts)
+        self.accounts_label.setText(f"Google Accounts: {', '.join(config.google_accounts)}")
+
+    # Add a Markdown checklist or CSV file as a task source
+    @QtCore.Slot()
+    def add_task_file(self):
+        file_filter = "Task files (*.md *.markdown *.csv)"
+        file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Select Task File", "", file_filter)
+        if not file_path:
+            return
+
+        kind = "csv" if file_path.lower().endswith(".csv") else "markdown"
+        if any(source.get("path") == file_path for source in config.task_sources):
+            return
+
+        config.task_sources = config.task_sources + [{"type": kind, "path": file_path}]
+        config.settings.setValue(config.TASK_SOURCES, json.dumps(config.task_sources))
+        self.update_task_files_label()
+
+    def update_task_files_label(self):
+        files = [os.path.basename(source["path"]) for source in config.task_sources if "path" in source]
+        self.task_files_label.setText(f"Task Files: {', '.join(files) if files else 'None'}")
+
+    @QtCore.Slot()
+    def schedule_preview(self):
+        self.preview_timer.start()
+
+    # Simulate the entered settings on the process pool, the results arrive through preview_ready
+    @QtCore.Slot()
+    def preview(self):
+        if not whatIf.ready():
+            self.preview_label.setText("Regenerate once to preview how the settings change your free time")
+            return
+
+        work_hours = self.entered_work_hours()
+        if work_hours is None:
+            return
+
+        # Only one simulation runs at a time, the latest settings are simulated once it is done
+        if self.preview_worker is not None and self.preview_worker.is_alive():
+            self.preview_pending = True
+            return
+
+        candidates = whatIf.candidates(work_hours, self.travel_time_input.value(), self.commute_time_input.value())
+        self.preview_worker = threading.Thread(target=self.run_preview, args=(candidates,), name="what-if", daemon=True)
+        self.preview_worker.start()
+
+    def run_preview(self, candidates):
+        try:
+            results = whatIf.simulate(candidates)
+        except Exception as error:
+            print(f"Previewing settings failed: {error}")
+            results = None
+        self.preview_ready.emit(results)
+
+    @QtCore.Slot(object)
+    def show_preview(self, results):
+        if self.preview_pending:
+            self.preview_pending = False
+            self.preview_timer.start()
+
+        if not results:
+            return
+
+        self.preview_label.setText(f"Preview against your calendar as of {whatIf.cached_at().strftime('%I:%M %p').lstrip('0')}, first row is the entered settings:")
+
+        # The entered settings stay on top, the alternatives follow from the best fill rate down
+        rows = results[:1] + sorted(results[1:], key=lambda result: (result["fill_rate"], result["free_minutes"]), reverse=True)
+
+        self.preview_table.setRowCount(len(rows))
+        for row, result in enumerate(rows):
+            values = [
+                f"{result['travel_time']} min",
+                f"{result['commute_time']} min",
+                f"{result['free_minutes'] // 60}h {result['free_minutes'] % 60:02}m",
+                str(result["blocks"]),
+                f"{result['fragmentation']:.0%}",
+                f"{result['fill_rate']:.0%}",
+            ]
+            for column, value in enumerate(values):
+                self.preview_table.setItem(row, column, QtWidgets.QTableWidgetItem(value))
+
+    # The entered work hours starting on Monday like config.work_hours, None if an end time is before its start time
+    def entered_work_hours(self) -> list[list[time]] | None:
+        times = []
+        for i in range(len(self.days)):
+            try:
+                lower = datetime.strptime(self.grid_time_layout.itemAtPosition(i + 1, 1).widget().text(), "%I:%M %p").time()
+                upper = datetime.strptime(self.grid_time_layout.itemAtPosition(i + 1, 2).widget().text(), "%I:%M %p").time()
+            except ValueError:
+                return None
+
+            if upper < lower:
+                return None
+            times += [[lower, upper]]
+
+        # The rows start on Sunday
+        return times[1:] + times[:1]
+
     @QtCore.Slot()
     def format_time(self, i, bound):
         if bound == "lower":
@@ -247,17 +454,12 @@ class SettingsWindow(QtWidgets.QWidget):
     @QtCore.Slot()
     def apply_settings(self):        
         """Apply the selected settings."""
-        times = []
-        for i in range(len(self.days)):
-            lower = datetime.strptime(self.grid_time_layout.itemAtPosition(i + 1, 1).widget().text(), "%I:%M %p").time()
-            upper = datetime.strptime(self.grid_time_layout.itemAtPosition(i + 1, 2).widget().text(), "%I:%M %p").time()
-
-            # Checks if the upper time is before the lower time
-            if upper < lower:
-                QtWidgets.QMessageBox.critical(self, "Error", "You cannot have the end time occur before the start time!", QtWidgets.QMessageBox.Ok)
-                return
+        times = self.entered_work_hours()
 
-            times += [[lower.isoformat(), upper.isoformat()]]
+        # Checks if the upper time is before the lower time
+        if times is None:
+            QtWidgets.QMessageBox.critical(self, "Error", "You cannot have the end time occur before the start time!", QtWidgets.QMessageBox.Ok)
+            return
 
         if self.light_mode_radio.isChecked():
             self.setStyleSheet("")  # Light mode (default)
@@ -269,19 +471,14 @@ class SettingsWindow(QtWidgets.QWidget):
             self.main_widget.setStyleSheet(dark_style)  # Dark mode for main widget
             config.settings.setValue(config.LIGHT_MODE_KEY, False)  # Save preference
 
-        temp = times[0]
-        for i in range(len(times) - 1):
-            times[i] = times[i + 1]
-        times[-1] = temp
-
-        config.settings.setValue(config.WORK_HOURS, times)
-        
-        for hours in times:
-            hours[0] = time.fromisoformat(hours[0])
-            hours[1] = time.fromisoformat(hours[1])
-
+        config.settings.setValue(config.WORK_HOURS, [[hours[0].isoformat(), hours[1].isoformat()] for hours in times])
         config.work_hours = times
 
+        config.travel_time = self.travel_time_input.value()
+        config.settings.setValue(config.TRAVEL_TIME, config.travel_time)
+        config.commute_time = self.commute_time_input.value()
+        config.settings.setValue(config.COMMUTE_TIME, config.commute_time)
+
         if self.use_gemini:
             self.gemini_key = self.model_key_input.toPlainText()
         else:
@@ -303,6 +500,22 @@ class SettingsWindow(QtWidgets.QWidget):
         
         config.use_gemini = self.use_gemini
         config.settings.setValue(config.USE_GEMINI, self.use_gemini)
+
+        # A new port only takes effect once the server is started again
+        if self.ics_port_input.value() != config.ics_port:
+            icsFeed.stop()
+            config.ics_port = self.ics_port_input.value()
+            config.settings.setValue(config.ICS_PORT, config.ics_port)
+            self.ics_label.setText(f"Feed URL: {icsFeed.url()}")
+
+        config.output_mode = "ics" if self.ics_checkbox.isChecked() else "calendar"
+        config.settings.setValue(config.OUTPUT_MODE, config.output_mode)
+        if config.output_mode == "ics":
+            error = icsFeed.start()
+            if error:
+                QtWidgets.QMessageBox.warning(self, "Error", f"{error}, choose another port!", QtWidgets.QMessageBox.Ok)
+        else:
+            icsFeed.stop()
         
         # Set Gemini API key
         utils.update_gemini_api_key()
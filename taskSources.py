@@ -0,0 +1,267 @@
+import abc
+import csv
+import hashlib
+import io
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import AI
+import cassette
+import config
+import ledger
+import rateLimiter
+
+# A source that could not be read completely, a plan from the other sources alone would drop its tasks
+class TaskSourceError(Exception):
+    pass
+
+# A place tasks come from, stream() yields the schedulable tasks one at a time so that
+# the first tasks can be used while the rest are still being fetched
+class TaskSource(abc.ABC):
+    kind = ""
+
+    def available(self) -> bool:
+        return True
+
+    @abc.abstractmethod
+    def stream(self):
+        pass
+
+    # Changes whenever the tasks of the source may have changed
+    @abc.abstractmethod
+    def version(self) -> str | None:
+        pass
+
+# The tasks of a Notion database, fetched a page of results at a time
+class NotionSource(TaskSource):
+    kind = "notion"
+
+    def __init__(self, database_id: str = None):
+        self.database_id = database_id or config.database_id
+
+    def available(self) -> bool:
+        return config.get_notion_client() is not None
+
+    def stream(self):
+        cursor = None
+
+        while True:
+            query = {
+                "database_id": self.database_id,
+                "filter": {
+                    "and": [
+                        {
+                            "property": "Status",
+                            "status": {
+                                "does_not_equal": "Done",
+                            }
+                        },
+                        {
+                            "property": "Schedulable",
+                            "checkbox": {
+                                "equals": True,
+                            },
+                        }
+                    ]
+                }
+            }
+            if cursor is not None:
+                query["start_cursor"] = cursor
+
+            response = rateLimiter.call("notion", config.get_notion_client().databases.query, **query)
+
+            for page in response["results"]:
+                yield self.task_from_page(page)
+
+            cursor = response.get("next_cursor")
+            if not response.get("has_more") or not cursor:
+                return
+
+    def task_from_page(self, page: dict) -> "AI.Task":
+        properties = page['properties']
+        title = properties['Title']['title'][0]['plain_text']
+        priority = properties['Priority']['select']
+        duration = properties['Duration']['select']
+
+        task = AI.Task(
+            id=page['id'],
+            title=title,
+            # If the user has not set a priority or duration, they are N/A
+            priority=priority['name'] if priority else "N/A",
+            duration=duration['name'] if duration else "N/A",
+            source=self.kind,
+        )
+
+        # Where the task was placed by an earlier run
+        scheduled = properties.get(config.scheduled_property, {}).get('date')
+        if scheduled:
+            task.scheduled_start = datetime.fromisoformat(scheduled['start']).astimezone()
+            if scheduled.get('end'):
+                task.scheduled_end = datetime.fromisoformat(scheduled['end']).astimezone()
+        task.event_link = properties.get(config.event_link_property, {}).get('url')
+        return task
+
+    # When any page of the database was last edited
+    def version(self) -> str | None:
+        response = rateLimiter.call(
+            "notion",
+            config.get_notion_client().databases.query,
+            database_id=self.database_id,
+            sorts=[{"timestamp": "last_edited_time", "direction": "descending"}],
+            page_size=1,
+        )
+        results = response["results"]
+        return f"{self.database_id}@{results[0]['last_edited_time'] if results else None}"
+
+# A local to-do file, the planned time of its tasks is only kept in the ledger
+class FileSource(TaskSource):
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+
+    # Replayed runs read the recorded file, it does not have to exist any more
+    def available(self) -> bool:
+        return cassette.mode == "replay" or os.path.exists(self.path)
+
+    def stream(self):
+        for title, priority, duration in self.parse(rateLimiter.call("files", read_file, self.path)):
+            task = AI.Task(
+                id=self.task_id(title),
+                title=title,
+                priority=priority or "N/A",
+                duration=duration or "N/A",
+                source=self.kind,
+            )
+
+            blocks = ledger.blocks_for_task(task.id)
+            if blocks:
+                task.scheduled_start = min(block.start for block in blocks)
+                task.scheduled_end = max(block.end for block in blocks)
+            yield task
+
+    # Yields (title, priority, duration) of every open task in the file
+    @abc.abstractmethod
+    def parse(self, text: str):
+        pass
+
+    # Tasks in files have no IDs, the file and title identify them
+    def task_id(self, title: str) -> str:
+        seed = f"{os.path.abspath(self.path)}|{title}"
+        return f"{self.kind}-{hashlib.sha1(seed.encode('utf-8')).hexdigest()}"
+
+    def version(self) -> str | None:
+        try:
+            return f"{self.path}@{os.path.getmtime(self.path)}"
+        except OSError:
+            return f"{self.path}@missing"
+
+# Markdown checklists, e.g. "- [ ] Write essay @priority(High) @duration(1 hour)"
+class MarkdownSource(FileSource):
+    kind = "markdown"
+
+    ITEM = re.compile(r"^\s*[-*+]\s+\[( |x|X)\]\s+(.+?)\s*$")
+    TAG = re.compile(r"@(priority|duration)\(([^)]*)\)", re.IGNORECASE)
+
+    def parse(self, text: str):
+        for line in text.splitlines():
+            match = self.ITEM.match(line)
+            if not match or match.group(1) != " ":
+                continue
+
+            tags = {name.lower(): value.strip() for name, value in self.TAG.findall(match.group(2))}
+            title = self.TAG.sub("", match.group(2)).strip()
+            if title:
+                yield title, tags.get("priority"), tags.get("duration")
+
+# CSV files with a title column and optional priority, duration and done columns
+class CSVSource(FileSource):
+    kind = "csv"
+
+    def parse(self, text: str):
+        for row in csv.DictReader(io.StringIO(text)):
+            row = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+            if not row.get("title") or row.get("done", "").lower() in ("x", "yes", "true", "1", "done"):
+                continue
+            yield row["title"], row.get("priority"), row.get("duration")
+
+def read_file(path: str) -> str:
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+SOURCE_TYPES = {
+    "notion": NotionSource,
+    "markdown": MarkdownSource,
+    "csv": CSVSource,
+}
+
+# The sources in config.task_sources, earlier sources win when the same task is in several
+def from_config() -> list[TaskSource]:
+    sources = []
+    for spec in config.task_sources:
+        options = {key: value for key, value in spec.items() if key != "type"}
+        sources.append(SOURCE_TYPES[spec["type"]](**options))
+    return sources
+
+# File task IDs start with the kind of their source, Notion page IDs never do
+def is_file_task(task_id: str) -> bool:
+    return any(
+        task_id.startswith(f"{kind}-")
+        for kind, source_type in SOURCE_TYPES.items() if issubclass(source_type, FileSource)
+    )
+
+def available() -> list[TaskSource]:
+    return [source for source in from_config() if source.available()]
+
+# The same task can be in several sources, it is recognised by its title
+def task_key(task: "AI.Task") -> str:
+    return " ".join(task.title.split()).casefold()
+
+# Stream the tasks of all sources concurrently, yielding (rank, task) in the order they arrive
+# rank is (index of the source, position in the source), a task is yielded again when a
+# better ranked source turns out to have it too, so consumers keep the last one per key
+# Raises TaskSourceError as soon as any source fails
+def merge(sources: list[TaskSource]):
+    results = queue.Queue()
+    done = object()
+
+    def run(index: int, source: TaskSource):
+        try:
+            for position, task in enumerate(source.stream()):
+                results.put(((index, position), task))
+        except Exception as error:
+            # Network, API and parse errors alike, the consumer decides what a failed source means
+            results.put(TaskSourceError(f"Reading tasks from {source.kind} failed: {error!r}"))
+        finally:
+            results.put(done)
+
+    for index, source in enumerate(sources):
+        threading.Thread(target=run, args=(index, source), name=f"tasks-{source.kind}", daemon=True).start()
+
+    best = {}
+    remaining = len(sources)
+    while remaining:
+        item = results.get()
+        if item is done:
+            remaining -= 1
+            continue
+        if isinstance(item, TaskSourceError):
+            raise item
+
+        rank, task = item
+        key = task_key(task)
+        if key in best and best[key] <= rank:
+            continue
+
+        best[key] = rank
+        yield rank, task
+
+# Versions of all sources, fetched concurrently since each may be a request
+def versions(sources: list[TaskSource]) -> list[str | None]:
+    if not sources:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        return list(executor.map(lambda source: source.version(), sources))
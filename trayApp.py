@@ -2,8 +2,13 @@ from PySide6 import QtCore, QtGui, QtWidgets
 
 import AI
 import config
+import conflictRepair
+import icsFeed
+import journal
+import memoryBudget
 import utils
 from mainWindow import MainWindow
+from prePlanner import PrePlanner
 
 # Tray window class
 class TrayApp(QtWidgets.QSystemTrayIcon):
@@ -15,6 +20,7 @@ class TrayApp(QtWidgets.QSystemTrayIcon):
         
         # Create the menu
         menu = QtWidgets.QMenu()
+        menu.aboutToShow.connect(self.touch)
 
         # Add "Open" option
         open_action = menu.addAction("Open")
@@ -32,6 +38,10 @@ class TrayApp(QtWidgets.QSystemTrayIcon):
         regenerate_week = menu.addAction("Regenerate Week")
         regenerate_week.triggered.connect(self.regenerate_week)
 
+        # Move only the blocks that new meetings landed on
+        repair_conflicts = menu.addAction("Repair Conflicts")
+        repair_conflicts.triggered.connect(self.repair_conflicts)
+
         test = menu.addAction("Test")
         test.triggered.connect(self.test)
 
@@ -44,6 +54,48 @@ class TrayApp(QtWidgets.QSystemTrayIcon):
         # Create the main window
         self.window = MainWindow()
 
+        # Resume sending calendar changes left over from the last session
+        journal.flush_async()
+
+        # Subscribed calendar apps read the plan from localhost
+        if config.output_mode == "ics":
+            error = icsFeed.start()
+            if error:
+                self.showMessage("AICalendar", f"{error}, choose another port in the settings", QtWidgets.QSystemTrayIcon.Warning)
+
+        # Prepare the regenerate actions in the background
+        self.pre_planner = PrePlanner(self)
+        self.pre_planner.prepare()
+
+        # Free memory after the tray has not been used for a while
+        self.idle_timer = QtCore.QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.timeout.connect(self.trim_memory)
+        self.idle_timer.start(config.idle_trim_minutes * 60 * 1000)
+        self.activated.connect(self.touch)
+
+    # Any interaction restarts the idle period and wakes the pre-planner
+    @QtCore.Slot()
+    def touch(self):
+        self.idle_timer.start(config.idle_trim_minutes * 60 * 1000)
+        self.pre_planner.resume()
+
+    @QtCore.Slot()
+    def trim_memory(self):
+        # Never pull modules out from under a plan that is being prepared
+        if self.pre_planner.busy():
+            self.idle_timer.start(60 * 1000)
+            return
+
+        if config.debug:
+            print("Before trimming\n" + memoryBudget.report())
+
+        self.pre_planner.pause()
+        memoryBudget.trim()
+
+        if config.debug:
+            print("After trimming\n" + memoryBudget.report())
+
     # Show the main window upon clicking "Open"
     @QtCore.Slot()
     def show_window(self):
@@ -52,20 +104,42 @@ class TrayApp(QtWidgets.QSystemTrayIcon):
     # Regenerate the day
     @QtCore.Slot()
     def regenerate_day(self):
-        AI.auto_schedule_tasks(1)
+        self.regenerate(1)
 
     @QtCore.Slot()
     def regenerate_3_days(self):
-        AI.auto_schedule_tasks(3)
+        self.regenerate(3)
     
     @QtCore.Slot()
     def regenerate_week(self):
-        AI.auto_schedule_tasks(7)
+        self.regenerate(7)
+
+    # Use the prepared plan if nothing changed since it was made, otherwise plan from scratch
+    def regenerate(self, days):
+        plan = self.pre_planner.take(days)
+
+        if plan is not None:
+            AI.apply_plan(plan)
+        else:
+            AI.auto_schedule_tasks(days)
+
+        self.pre_planner.invalidate()
     
+    @QtCore.Slot()
+    def repair_conflicts(self):
+        unresolved = conflictRepair.repair_conflicts(7)
+        if unresolved:
+            self.showMessage(
+                "AICalendar",
+                f"{len(unresolved)} AI blocks overlap your events and have no free slot left, regenerate to replan them",
+                QtWidgets.QSystemTrayIcon.Warning,
+            )
+        self.pre_planner.invalidate()
+
     @QtCore.Slot()
     def test(self):        
         AI.check_AI_tasks_calendar()
-        AI.parse_passed_tasks()
+        AI.parse_passed_tasks(1)
 
     # Exit the application upon clicking "Exit"
     @QtCore.Slot()
@@ -1,9 +1,6 @@
 import os
 import sys
 
-from google import genai
-from notion_client import Client as NotionClient
-
 import config
 
 # Apply the initial theme based on the light mode preference, referenced by all windows
@@ -19,22 +16,10 @@ def resource_path(relative_path) -> str:
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.abspath(relative_path)
 
-# Update the API key for Gemini
+# Update the API key for Gemini, the client is recreated with the new key on next use
 def update_gemini_api_key() -> None:
-    global gemini_client
-
-    gemini_key = config.settings.value(config.GEMINI_KEY, "", type=str)
-    if gemini_key:
-        gemini_client = genai.Client(api_key=gemini_key)
-    else:
-        gemini_client = None
+    config.gemini_client = None
 
-# Update the API key for Notion
+# Update the API key for Notion, the client is recreated with the new key on next use
 def notion_key() -> None:
-    global notion_client
-
-    notion_key = config.settings.value(config.GEMINI_KEY, "", type=str)
-    if notion_key:
-        notion_client = NotionClient(auth=config.settings.value(config.NOTION_TOKEN, "", type=str))
-    else:
-        notion_client = None
+    config.notion_client = None
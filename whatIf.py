@@ -0,0 +1,84 @@
+import math
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import config
+import freeTime
+
+# Travel and commute times (minutes) tried next to the entered ones
+TRAVEL_OPTIONS = (0, 5, 10, 15, 20, 30)
+COMMUTE_OPTIONS = (0, 15, 30, 45, 60)
+
+# Busy time and tasks of the last plan, other settings are simulated against these without any requests
+cache = {"days": 0, "busy": None, "now": None, "task_minutes": []}
+cache_lock = threading.Lock()
+
+pool = None
+pool_lock = threading.Lock()
+
+def remember_busy(days: int, busy: list, now):
+    with cache_lock:
+        cache.update({"days": days, "busy": busy, "now": now})
+
+def remember_tasks(tasks: list):
+    minutes = []
+    for task in tasks or []:
+        parsed = freeTime.parse_minutes(task.duration)
+        minutes.append(parsed if parsed else freeTime.DEFAULT_TASK_MINUTES)
+
+    with cache_lock:
+        cache["task_minutes"] = minutes
+
+def ready() -> bool:
+    with cache_lock:
+        return cache["busy"] is not None
+
+# When the cached busy time was read
+def cached_at():
+    with cache_lock:
+        return cache["now"]
+
+# The entered settings first, then every combination of the travel and commute options with the same work hours
+def candidates(work_hours: list, travel_time: int, commute_time: int) -> list[tuple]:
+    result = [(work_hours, travel_time, commute_time)]
+    for travel in TRAVEL_OPTIONS:
+        for commute in COMMUTE_OPTIONS:
+            if (travel, commute) != (travel_time, commute_time):
+                result.append((work_hours, travel, commute))
+    return result
+
+# The workers are started once and reused, so later previews do not pay for starting processes
+def get_pool() -> ProcessPoolExecutor:
+    global pool
+
+    with pool_lock:
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=config.what_if_workers)
+        return pool
+
+def shutdown():
+    global pool
+
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            pool = None
+
+# Metrics of every candidate in the same order, None if nothing has been planned yet
+def simulate(candidates: list[tuple]) -> list[dict] | None:
+    with cache_lock:
+        if cache["busy"] is None:
+            return None
+        evaluate = partial(
+            freeTime.evaluate,
+            days=cache["days"],
+            busy=cache["busy"],
+            now=cache["now"],
+            start_of_day=config.debug_time_starts_at_beginning_of_day,
+            task_minutes=cache["task_minutes"],
+        )
+
+    # One chunk per worker so the busy time is only sent to each worker once
+    chunksize = math.ceil(len(candidates) / config.what_if_workers)
+    return list(get_pool().map(evaluate, candidates, chunksize=chunksize))